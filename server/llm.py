@@ -0,0 +1,95 @@
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
+from utils.embedding_cache import EmbeddingCache, cache_key
+import asyncio
+import httpx
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+load_dotenv(".env.local")
+
+OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# One keep-alive connection pool per worker, shared by every OpenRouter call.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "30"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_PATH = Path(os.getenv(
+    "EMBEDDING_CACHE_PATH", str(Path(__file__).resolve().parent / "data" / "embedding_cache.sqlite")))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+    ),
+    timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0),
+)
+
+llm_client = None
+if OPENROUTER_KEY:
+    llm_client = AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_KEY, http_client=http_client)
+else:
+    logger.warning("OPENROUTER_API_KEY not set. LLM/Embeddings calls will fail if attempted.")
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_SIZE)
+# concurrent requests for the same text share one upstream call (a detached task)
+_inflight: Dict[bytes, "asyncio.Task"] = {}
+
+
+async def _fetch_embedding(text: str, model: str) -> Optional[List[float]]:
+    resp = await llm_client.embeddings.create(model=model, input=text)
+    # The SDK may return an object or dict; handle both
+    if hasattr(resp, "data") and len(resp.data) > 0:
+        return list(resp.data[0].embedding)
+    if isinstance(resp, dict) and "data" in resp and len(resp["data"]) > 0:
+        return list(resp["data"][0]["embedding"])
+    logger.warning("Unexpected embeddings response shape: %s", type(resp))
+    return None
+
+
+async def _fetch_and_cache(text: str, model: str) -> Optional[List[float]]:
+    emb = await _fetch_embedding(text, model)
+    if emb is not None:
+        await run_in_threadpool(embedding_cache.put, model, text, emb)
+    return emb
+
+
+def _fetch_done(key: bytes, task: "asyncio.Task"):
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()   # retrieved here, so a failure nobody awaited isn't logged as unhandled
+
+
+async def embed(text: str, model: str = EMBEDDING_MODEL) -> Optional[List[float]]:
+    """
+    Embedding for text, served from the LRU / SQLite cache when this exact
+    text was embedded before with the same model. Raises on upstream errors.
+    """
+    if llm_client is None:
+        return None
+    emb = await run_in_threadpool(embedding_cache.get, model, text)
+    if emb is not None:
+        return emb
+    key = cache_key(model, text)
+    task = _inflight.get(key)
+    if task is None:
+        # not owned by any one request: cancelling a request only cancels its own wait
+        task = _inflight[key] = asyncio.ensure_future(_fetch_and_cache(text, model))
+        task.add_done_callback(lambda t: _fetch_done(key, t))
+    return await asyncio.shield(task)
+
+
+async def close_llm_client():
+    await http_client.aclose()
+    embedding_cache.close()
@@ -10,6 +10,7 @@ from routes import user
 from routes import drafts
 from routes import cases
 from routes.oauth_google import router as oauth_router
+from llm import close_llm_client
 import os
 
 load_dotenv(".env.local")
@@ -44,3 +45,8 @@ app.include_router(user.router)
 app.include_router(drafts.router)
 app.include_router(oauth_router)
 app.include_router(cases.router)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_llm_client()
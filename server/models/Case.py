@@ -3,7 +3,7 @@ from typing import List, Optional, Literal, Dict
 from pydantic import BaseModel, Field
 
 Outcome = Literal["allowed","dismissed","partly","na"]
-SearchMode = Literal["all","citation","parties","facts"]
+SearchMode = Literal["all","citation","parties","facts","hybrid"]
 
 class CaseStub(BaseModel):
     id: str
@@ -15,6 +15,7 @@ class CaseStub(BaseModel):
     reporter_citations: Optional[List[str]] = None
     issues: Optional[List[str]] = None
     why: Optional[str] = None
+    snippets: Optional[List[str]] = None   # best passages, query words in <mark>
 
 class CaseParties(BaseModel):
     appellant: Optional[List[str]] = None
@@ -48,3 +49,34 @@ class SearchRequest(BaseModel):
     q: str
     mode: SearchMode = "all"
     filters: SearchFilters = SearchFilters()
+    snippets: bool = True
+
+class SearchFacets(BaseModel):
+    court: Dict[str, int] = {}
+    year: Dict[str, int] = {}
+    outcome: Dict[str, int] = {}
+
+class FacetedSearchResponse(BaseModel):
+    hits: List[CaseStub]
+    facets: SearchFacets
+
+class Suggestion(BaseModel):
+    text: str
+    kind: Literal["title","party","citation"]
+    case_id: Optional[str] = None   # titles and citations open a case directly
+    score: float
+
+class BulkCaseRequest(BaseModel):
+    ids: List[str] = Field(..., max_length=1000)
+
+class PagedSearchRequest(SearchRequest):
+    page_size: int = Field(25, ge=1, le=100)
+    cursor: Optional[str] = None   # next_cursor of the previous page
+
+class SearchPage(BaseModel):
+    hits: List[CaseStub]
+    next_cursor: Optional[str] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest] = Field(..., max_length=500)
+    top_k: int = Field(25, ge=1, le=100)
@@ -1,37 +1,93 @@
 # routes/cases.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List
-from models.Case import CaseStub, CaseDoc, SearchRequest
-from utils.search import get_index
+import os
+import secrets
+from models.Case import (CaseStub, CaseDoc, SearchRequest, FacetedSearchResponse,
+                         PagedSearchRequest, SearchPage, BatchSearchRequest, Suggestion, BulkCaseRequest)
+from utils.case_store import case_stub, dumps, hit_json
+from utils.search import get_index, query_cache, search_page, rebuild_in_background, rebuild_status
 
 router = APIRouter(prefix="/cases", tags=["cases"])
 
+# Shared secret for the index admin endpoints (unset = disabled).
+ADMIN_TOKEN = os.getenv("CASE_ADMIN_TOKEN") or ""
+
+def _require_admin(token: str | None):
+    if not ADMIN_TOKEN or not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(403, "Forbidden")
+
+def _stub(c: dict, why: str | None = None) -> CaseStub:
+    return CaseStub(**case_stub(c), why=why)
+
+def _hits_json(idx, hits, q: str | None = None) -> bytes:
+    # search results skip pydantic: each stub was encoded once at index load, only `why`
+    # (and, given the query, the highlighted snippets) is added here
+    snippets = idx.snippets_for(q, [cid for cid, _, _ in hits]) if q else {}
+    return b"[" + b",".join(hit_json(idx.stub_json(cid), why, snippets.get(cid)) for cid, _, why in hits) + b"]"
+
+def _json(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
 @router.post("/search", response_model=List[CaseStub])
 def search(req: SearchRequest):
     idx = get_index()
-    hits = idx.query(req.q, req.filters.model_dump())
-    out: List[CaseStub] = []
-    for cid, _, why in hits:
-        c = idx.cases[cid]
-        out.append(CaseStub(
-            id=c["id"],
-            title=c.get("title",""),
-            court=c.get("court",""),
-            date=c.get("date",""),
-            outcome=c.get("outcome","na"),
-            neutral_citation=c.get("neutral_citation"),
-            reporter_citations=c.get("reporter_citations"),
-            issues=(c.get("issues_split") or c.get("issues") or "").split(";") if c.get("issues") else None,
-            why=why,
-        ))
-    return out
+    hits = idx.query(req.q, req.filters.model_dump(), mode=req.mode)
+    return _json(_hits_json(idx, hits, req.q if req.snippets else None))
 
-@router.get("/{case_id}", response_model=CaseDoc)
-def get_case(case_id: str):
+@router.post("/search/faceted", response_model=FacetedSearchResponse)
+def search_faceted(req: SearchRequest):
+    """Hits plus court / year / outcome counts over all matches, in one round trip."""
     idx = get_index()
-    c = idx.cases.get(case_id)
-    if not c:
-        raise HTTPException(404, "Case not found")
+    hits, facets = idx.query_faceted(req.q, req.filters.model_dump(), mode=req.mode)
+    return _json(b'{"hits":' + _hits_json(idx, hits, req.q if req.snippets else None) + b',"facets":' + dumps(facets) + b"}")
+
+@router.post("/search/page", response_model=SearchPage)
+def search_paged(req: PagedSearchRequest):
+    """One page of hits; pass next_cursor back to continue (any worker can serve it)."""
+    idx = get_index()
+    try:
+        hits, cursor, q = search_page(idx, req.q, req.filters.model_dump(), req.mode, req.page_size, req.cursor)
+    except KeyError:
+        raise HTTPException(400, "Invalid search cursor")
+    # snippets highlight the query the hits came from (the cursor's on later pages)
+    return _json(b'{"hits":' + _hits_json(idx, hits, q if req.snippets else None) + b',"next_cursor":' + dumps(cursor) + b"}")
+
+@router.post("/search/batch", response_model=List[List[CaseStub]])
+def search_batch(req: BatchSearchRequest):
+    """Top hits for many queries in one call, scored together where they share mode and filters (no snippets)."""
+    idx = get_index()
+    results = idx.query_batch([{"q": r.q, "mode": r.mode, "filters": r.filters.model_dump()} for r in req.queries], req.top_k)
+    return _json(b"[" + b",".join(_hits_json(idx, hits) for hits in results) + b"]")
+
+@router.get("/suggest", response_model=List[Suggestion])
+def suggest(q: str = Query(..., max_length=200), limit: int = Query(8, ge=1, le=20)):
+    """Typeahead over case titles, party names and citations (prefix match, no scoring pass)."""
+    return _json(dumps(get_index().suggest(q, limit)))
+
+@router.get("/search/stats")
+def search_stats():
+    idx = get_index()
+    return {"generation": idx.generation, "cache": query_cache.stats()}
+
+@router.post("/admin/reindex", status_code=202)
+def reindex(x_admin_token: str | None = Header(None)):
+    """Rebuild the index in the background and hot-swap it once validated."""
+    _require_admin(x_admin_token)
+    started = rebuild_in_background() is not None
+    return {"started": started, **rebuild_status}
+
+@router.get("/admin/reindex")
+def reindex_status(x_admin_token: str | None = Header(None)):
+    _require_admin(x_admin_token)
+    return {**rebuild_status, "serving": get_index().generation}
+
+# ids read per bulk store access while streaming /cases/bulk
+BULK_CHUNK = 64
+
+def _case_doc(idx, c: dict) -> CaseDoc:
+    case_id = c["id"]
     return CaseDoc(
         id=c["id"],
         title=c.get("title",""),
@@ -46,6 +102,38 @@ def get_case(case_id: str):
         parties=c.get("parties"),
         timeline=c.get("timeline",[]) or [],
         orders=c.get("orders",[]) or [],
-        citations=c.get("citations", {"cites":[],"citedBy":[]}),
-        similar=[CaseStub(**s) for s in c.get("similar",[]) or []] if c.get("similar") else [],
+        citations=c.get("citations") or idx.citation_links(case_id),
+        similar=(
+            [CaseStub(**s) for s in c["similar"]] if c.get("similar")
+            else [_stub(s, f"Similarity {score:.2f}") for s, score in idx.similar_cases(case_id)]
+        ),
     )
+
+@router.post("/bulk", response_model=List[CaseDoc])
+def get_cases(req: BulkCaseRequest, request: Request):
+    """
+    Many CaseDocs in one round trip, in request order. Unknown ids are left out of
+    the JSON array; with `Accept: application/x-ndjson` the docs are streamed one
+    per line and an unknown id yields {"id": ..., "error": "Case not found"}.
+    """
+    idx = get_index()
+    if "application/x-ndjson" not in request.headers.get("accept", ""):
+        docs = [_case_doc(idx, c) for c in idx.get_cases(req.ids) if c]
+        return _json(b"[" + b",".join(d.model_dump_json().encode("utf-8") for d in docs) + b"]")
+
+    def lines():
+        for lo in range(0, len(req.ids), BULK_CHUNK):
+            part = req.ids[lo:lo + BULK_CHUNK]
+            for cid, c in zip(part, idx.get_cases(part)):
+                yield (_case_doc(idx, c).model_dump_json().encode("utf-8") if c
+                       else dumps({"id": cid, "error": "Case not found"})) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/{case_id}", response_model=CaseDoc)
+def get_case(case_id: str):
+    idx = get_index()
+    c = idx.get_case(case_id)
+    if not c:
+        raise HTTPException(404, "Case not found")
+    return _case_doc(idx, c)
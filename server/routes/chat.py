@@ -1,16 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from openai import OpenAI
 from bson import ObjectId
+from pymongo import ReturnDocument
 from models import User
 from utils.auth_utils import get_current_user
 from db import chats_collection
+from llm import llm_client, embed
 import os
 from dotenv import load_dotenv
 import chromadb
 from datetime import datetime
 import tiktoken
 import re
+import json
+import time
+import asyncio
 import logging
 from typing import List
 
@@ -23,6 +29,15 @@ load_dotenv(".env.local")
 MAX_INPUT_TOKENS = 6000
 RESPONSE_TOKEN_BUFFER = 1000
 MODEL_TOKEN_LIMIT = 64000
+# history read per turn: the latest HISTORY_FIRST_MESSAGES, widened (up to the cap) only
+# while the messages read fall short of the token budget and the chat holds older ones
+HISTORY_FIRST_MESSAGES = int(os.getenv("CHAT_HISTORY_FIRST_MESSAGES", "16"))
+HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "100"))
+CHAT_MODEL = "minimax/minimax-m2:free"
+
+# streamed answers are written to the chat every this many chars / seconds
+STREAM_CHECKPOINT_CHARS = int(os.getenv("CHAT_STREAM_CHECKPOINT_CHARS", "800"))
+STREAM_CHECKPOINT_SECONDS = float(os.getenv("CHAT_STREAM_CHECKPOINT_SECONDS", "2"))
 
 # tokenizer
 try:
@@ -39,16 +54,20 @@ def count_tokens(text: str) -> int:
         return max(0, len(text) // 4)
 
 
-router = APIRouter(prefix="/api")
+def stored_message(role: str, content: str, tokens: int | None = None) -> dict:
+    """A chat message as written to chats_collection, with its token count."""
+    return {"role": role, "content": content, "tokens": count_tokens(content) if tokens is None else tokens}
+
 
-# OpenRouter/OpenAI client (used for both chat and embeddings)
-OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
-if not OPENROUTER_KEY:
-    logger.warning("OPENROUTER_API_KEY not set. LLM/Embeddings calls will fail if attempted.")
+def message_tokens(msg) -> int:
+    # messages written before counts were stored are tokenized on read
+    if isinstance(msg, dict):
+        tokens = msg.get("tokens")
+        return tokens if tokens is not None else count_tokens(str(msg.get("content", "")))
+    return count_tokens(str(msg))
 
-llm_client = None
-if OPENROUTER_KEY:
-    llm_client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=OPENROUTER_KEY)
+
+router = APIRouter(prefix="/api")
 
 
 # --- Chroma client (keep persistent local DB for retrieval) ---
@@ -62,7 +81,7 @@ except Exception as e:
 
 
 # --- get_relevant_context using external embeddings (OpenRouter / OpenAI) ---
-def get_relevant_context(query: str, top_k: int = 5) -> List[str]:
+async def get_relevant_context(query: str, top_k: int = 5) -> List[str]:
     """
     Get top-k relevant document chunks using OpenRouter embeddings + Chroma query.
     Falls back to a simple empty list if either embeddings or chroma are unavailable.
@@ -76,20 +95,14 @@ def get_relevant_context(query: str, top_k: int = 5) -> List[str]:
         return []
 
     try:
-        # Create embedding via OpenRouter (OpenAI SDK wrapper)
-        # Model name may vary — use a small embedding model suitable for OpenRouter/OpenAI
-        emb_resp = llm_client.embeddings.create(model="text-embedding-3-small", input=query)
-        # The SDK may return an object or dict; handle both
-        if hasattr(emb_resp, "data") and len(emb_resp.data) > 0:
-            query_embedding = emb_resp.data[0].embedding
-        elif isinstance(emb_resp, dict) and "data" in emb_resp and len(emb_resp["data"]) > 0:
-            query_embedding = emb_resp["data"][0]["embedding"]
-        else:
-            logger.warning("Unexpected embeddings response shape: %s", type(emb_resp))
+        # Create embedding via OpenRouter (cached per model + text, see llm.embed)
+        query_embedding = await embed(query)
+        if query_embedding is None:
             return []
 
-        # Query chroma using the embedding
-        results = collection.query(
+        # Query chroma using the embedding (local and blocking: run it off the event loop)
+        results = await run_in_threadpool(
+            collection.query,
             query_embeddings=[query_embedding],
             n_results=top_k,
             include=["documents", "metadatas"]
@@ -107,7 +120,7 @@ def get_relevant_context(query: str, top_k: int = 5) -> List[str]:
         return []
 
 
-def build_contextual_messages(past_messages, new_prompt, context_text):
+def build_contextual_messages(past_messages, new_prompt, context_text, prompt_tokens: int | None = None):
     system_msg = {
         "role": "system",
         "content": (
@@ -119,12 +132,14 @@ def build_contextual_messages(past_messages, new_prompt, context_text):
         )
     }
 
-    total_tokens = count_tokens(system_msg["content"]) + count_tokens(new_prompt)
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(new_prompt)
+    total_tokens = count_tokens(system_msg["content"]) + prompt_tokens
     selected_messages = []
 
     for msg in reversed(past_messages or []):  # latest messages first
         content = str(msg.get("content", "")) if isinstance(msg, dict) else str(msg)
-        msg_tokens = count_tokens(content)
+        msg_tokens = message_tokens(msg)
         if total_tokens + msg_tokens > (MAX_INPUT_TOKENS - RESPONSE_TOKEN_BUFFER):
             break
         # preserve role/content shape
@@ -146,6 +161,29 @@ class Message(BaseModel):
     content: str
 
 
+def clean_reply(text: str) -> str:
+    return re.sub(r'\n\s*\n+', '\n\n', (text or "").strip())
+
+
+def sse(data: dict, event: str | None = None) -> str:
+    """One Server-Sent Events frame."""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def timed(timings: dict, stage: str, aw):
+    """Await aw, recording its wall time in ms under timings[stage]."""
+    t0 = time.perf_counter()
+    try:
+        return await aw
+    finally:
+        timings[stage] = (time.perf_counter() - t0) * 1000
+
+
+def server_timing(timings: dict) -> str:
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings.items())
+
+
 def serialize_chat(chat):
     chat["_id"] = str(chat["_id"])
     return chat
@@ -161,47 +199,72 @@ async def count_tokens_api(req: TokenCountRequest):
     return {"tokens": count_tokens(req.text)}
 
 
-@router.post("/chat")
-async def ask_llm(request: ChatRequest, user: User = Depends(get_current_user)):
-    try:
-        if not request.prompt or not request.prompt.strip():
-            raise HTTPException(status_code=400, detail="Prompt is empty")
-
-        chat_id = request.chat_id
-
-        if not chat_id:
-            chat = {"user_id": user.id, "messages": [], "createdAt": datetime.now()}
-            result = await chats_collection.insert_one(chat)
-            chat_id = str(result.inserted_id)
-
-        # Save User Message
-        user_message = {"role": "user", "content": request.prompt}
-        await chats_collection.update_one(
-            {"_id": ObjectId(chat_id), "user_id": user.id},
-            {"$push": {"messages": user_message}}
-        )
+async def save_prompt(request: ChatRequest, user: User, user_message: dict):
+    """Store the user's prompt (creating the chat if needed) -> (chat_id, recent history before the prompt)."""
+    if not request.chat_id:
+        chat = {"user_id": user.id, "messages": [user_message], "token_total": user_message["tokens"],
+                "createdAt": datetime.now()}
+        result = await chats_collection.insert_one(chat)
+        return str(result.inserted_id), []
+
+    # Save User Message and read the recent history in the same round trip
+    query = {"_id": ObjectId(request.chat_id), "user_id": user.id}
+    window = min(HISTORY_FIRST_MESSAGES, HISTORY_MAX_MESSAGES)
+    chat_doc = await chats_collection.find_one_and_update(
+        query,
+        {"$push": {"messages": user_message}, "$inc": {"token_total": user_message["tokens"]}},
+        projection={"messages": {"$slice": -window}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    past = chat_doc.get("messages", []) if chat_doc else []
+    budget = MAX_INPUT_TOKENS - RESPONSE_TOKEN_BUFFER - user_message["tokens"]
+    # a full window of messages that don't fill the budget: older ones may still fit
+    while len(past) == window < HISTORY_MAX_MESSAGES and sum(message_tokens(m) for m in past) < budget:
+        # re-reading these short messages along with older ones costs less than the budget
+        window = min(window * 4, HISTORY_MAX_MESSAGES)
+        doc = await chats_collection.find_one(query, projection={"messages": {"$slice": -(window + 1)}})
+        past = (doc or {}).get("messages", [])[:-1]   # minus the prompt just pushed
+    return request.chat_id, past
+
+
+async def prepare_chat(request: ChatRequest, user: User):
+    """
+    Store the user's prompt and build the LLM messages -> (chat_id, messages, context, timings).
+    Retrieval (embedding + Chroma) and the Mongo write/history read run concurrently.
+    """
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt is empty")
+
+    timings = {}
+    user_message = stored_message("user", request.prompt)
+    context_chunks, (chat_id, past_messages) = await asyncio.gather(
+        timed(timings, "retrieve", get_relevant_context(request.prompt)),
+        timed(timings, "history", save_prompt(request, user, user_message)),
+    )
+    context_text = "\n\n".join(context_chunks)
 
-        # Retrieve relevant context chunks (via OpenRouter embeddings + Chroma)
-        context_chunks = get_relevant_context(request.prompt)
-        context_text = "\n\n".join(context_chunks)
+    # Build token-aware message list
+    t0 = time.perf_counter()
+    messages_for_llm = build_contextual_messages(past_messages, request.prompt, context_text, user_message["tokens"])
+    timings["build"] = (time.perf_counter() - t0) * 1000
+    return chat_id, messages_for_llm, context_text, timings
 
-        # Fetch full chat history
-        chat_doc = await chats_collection.find_one({"_id": ObjectId(chat_id), "user_id": user.id})
-        past_messages = chat_doc.get("messages", []) if chat_doc else []
 
-        # Build token-aware message list
-        messages_for_llm = build_contextual_messages(past_messages, request.prompt, context_text)
+@router.post("/chat")
+async def ask_llm(request: ChatRequest, resp: Response, user: User = Depends(get_current_user)):
+    try:
+        chat_id, messages_for_llm, context_text, timings = await prepare_chat(request, user)
 
         # Call LLM (ensure llm_client configured)
         if llm_client is None:
             raise HTTPException(status_code=500, detail="LLM client not configured on server.")
 
-        response = llm_client.chat.completions.create(
-            model="minimax/minimax-m2:free",
+        response = await timed(timings, "llm", llm_client.chat.completions.create(
+            model=CHAT_MODEL,
             messages=messages_for_llm,
             temperature=0.6,
             top_p=0.95
-        )
+        ))
 
         assistant_reply = ""
         try:
@@ -221,16 +284,17 @@ async def ask_llm(request: ChatRequest, user: User = Depends(get_current_user)):
         except Exception:
             logger.exception("Failed to parse LLM response")
 
-        assistant_reply = assistant_reply.strip()
-        assistant_reply = re.sub(r'\n\s*\n+', '\n\n', assistant_reply)
+        assistant_reply = clean_reply(assistant_reply)
 
         # Save Assistant Response
-        assistant_message = {"role": "assistant", "content": assistant_reply}
-        await chats_collection.update_one(
+        assistant_message = stored_message("assistant", assistant_reply)
+        await timed(timings, "save", chats_collection.update_one(
             {"_id": ObjectId(chat_id), "user_id": user.id},
-            {"$push": {"messages": assistant_message}}
-        )
+            {"$push": {"messages": assistant_message}, "$inc": {"token_total": assistant_message["tokens"]}}
+        ))
 
+        logger.info("chat %s stages (ms): %s", chat_id, server_timing(timings))
+        resp.headers["Server-Timing"] = server_timing(timings)
         return {"answer": assistant_reply, "context": context_text, "chat_id": chat_id}
 
     except Exception as e:
@@ -238,6 +302,78 @@ async def ask_llm(request: ChatRequest, user: User = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/chat/stream")
+async def ask_llm_stream(request: ChatRequest, user: User = Depends(get_current_user)):
+    """
+    Like /chat, but relays the answer over Server-Sent Events as it is generated:
+    a `meta` event (chat_id), `data` frames with {"delta": ...}, then `done` with
+    the final answer (or `error`). The assistant message is written to the chat at
+    checkpoints while streaming and finalized at the end.
+    """
+    if llm_client is None:
+        raise HTTPException(status_code=500, detail="LLM client not configured on server.")
+    chat_id, messages_for_llm, _, timings = await prepare_chat(request, user)
+    started = time.perf_counter()
+
+    message_id = str(ObjectId())
+    query = {"_id": ObjectId(chat_id), "user_id": user.id}
+    await chats_collection.update_one(query, {"$push": {"messages": {
+        "role": "assistant", "content": "", "id": message_id, "status": "streaming"}}})
+
+    async def checkpoint(text: str, status: str | None):
+        update = {"$set": {"messages.$.content": text}}
+        if status:
+            update["$set"]["messages.$.status"] = status
+        else:
+            update["$unset"] = {"messages.$.status": ""}
+        if status != "streaming":
+            # final (or interrupted) text: count it once
+            tokens = count_tokens(text)
+            update["$set"]["messages.$.tokens"] = tokens
+            update["$inc"] = {"token_total": tokens}
+        await chats_collection.update_one({**query, "messages.id": message_id}, update)
+
+    async def events():
+        parts: List[str] = []
+        saved_len, saved_at = 0, time.monotonic()
+        status = "interrupted"
+        yield sse({"chat_id": chat_id, "message_id": message_id}, event="meta")
+        try:
+            stream = await llm_client.chat.completions.create(
+                model=CHAT_MODEL, messages=messages_for_llm, temperature=0.6, top_p=0.95, stream=True,
+            )
+            async for chunk in stream:
+                choices = getattr(chunk, "choices", None) or []
+                delta = getattr(choices[0].delta, "content", None) if choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    timings["first_token"] = (time.perf_counter() - started) * 1000
+                parts.append(delta)
+                yield sse({"delta": delta})
+                length = sum(map(len, parts))
+                if length - saved_len >= STREAM_CHECKPOINT_CHARS or time.monotonic() - saved_at >= STREAM_CHECKPOINT_SECONDS:
+                    await checkpoint("".join(parts), "streaming")
+                    saved_len, saved_at = length, time.monotonic()
+            status = None
+            answer = clean_reply("".join(parts))
+            yield sse({"answer": answer, "chat_id": chat_id}, event="done")
+        except Exception as e:
+            logger.exception("ask_llm_stream error")
+            yield sse({"detail": str(e)}, event="error")
+        finally:
+            # also runs when the client disconnects mid-answer: keep what was generated
+            text = clean_reply("".join(parts)) if status is None else "".join(parts)
+            await asyncio.shield(checkpoint(text, status))
+            timings["llm"] = (time.perf_counter() - started) * 1000
+            logger.info("chat %s stages (ms): %s", chat_id, server_timing(timings))
+
+    # headers go out before generation starts, so they carry the pre-LLM stages only
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                      "Server-Timing": server_timing(timings)})
+
+
 @router.get("/chats")
 async def get_chats(user: User = Depends(get_current_user)):
     chats = await chats_collection.find({"user_id": user.id}).to_list(length=None)
@@ -245,7 +381,8 @@ async def get_chats(user: User = Depends(get_current_user)):
         "_id": str(chat["_id"]),
         "title": f"Chat {str(chat['_id'])[-4:]}",  # Temporary title
         "preview": chat["messages"][0]["content"][:50] if chat.get("messages") else "",
-        "createdAt" : chat.get("createdAt")
+        "createdAt" : chat.get("createdAt"),
+        "tokens": chat.get("token_total", 0),
     } for chat in chats]
 
 
@@ -287,9 +424,10 @@ async def create_chat(user: User = Depends(get_current_user)):
 
 @router.post("/chats/{chat_id}/message")
 async def add_message(chat_id: str, message: Message, user: User = Depends(get_current_user)):
+    stored = stored_message(message.role, message.content)
     update_result = await chats_collection.update_one(
         {"_id": ObjectId(chat_id), "user_id": user.id},
-        {"$push": {"messages": message.dict()}}
+        {"$push": {"messages": stored}, "$inc": {"token_total": stored["tokens"]}}
     )
     if update_result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Chat not found")
@@ -313,7 +451,8 @@ async def process_file(request: FileTextRequest, user: User = Depends(get_curren
         }
 
     # If within limits → create a new chat and insert
-    chat = {"user_id": user.id, "messages": [{"role": "user", "content": text}], "createdAt": datetime.now()}
+    chat = {"user_id": user.id, "messages": [stored_message("user", text, token_count)], "token_total": token_count,
+            "createdAt": datetime.now()}
     result = await chats_collection.insert_one(chat)
 
     return {"status": "ok", "chat_id": str(result.inserted_id)}
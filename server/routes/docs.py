@@ -2,10 +2,11 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from openai import OpenAI
+from llm import llm_client, embed
 import os
 import json
 import re
+import asyncio
 from typing import List, Dict, Optional
 import numpy as np
 
@@ -14,15 +15,6 @@ file_path = os.path.join(BASE_DIR, "data", "drafts.json")
 
 router = APIRouter(prefix="/docs")
 
-# --- LLM / Embeddings client (OpenRouter) ---
-OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
-if not OPENROUTER_KEY:
-    print("Warning: OPENROUTER_API_KEY not set. LLM/Embeddings calls will fail if attempted.")
-
-llm_client: Optional[OpenAI] = None
-if OPENROUTER_KEY:
-    llm_client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=OPENROUTER_KEY)
-
 # --- In-memory caches ---
 # Each template: { "slug":..., "title":..., "description":..., "body":..., "embedding": [floats] (optional) }
 TEMPLATES: List[Dict] = []
@@ -88,7 +80,7 @@ def cos_sim(a: List[float], b: List[float]) -> float:
     return float(np.dot(a_arr, b_arr) / denom)
 
 
-def get_embedding_for_text(text: str) -> Optional[List[float]]:
+async def get_embedding_for_text(text: str) -> Optional[List[float]]:
     """
     Use OpenRouter/OpenAI embeddings API to get embedding for a single text.
     Returns a plain Python list of floats or None on failure.
@@ -97,23 +89,14 @@ def get_embedding_for_text(text: str) -> Optional[List[float]]:
         print("Embeddings client not configured.")
         return None
     try:
-        # model name can be changed to whichever is supported in your OpenRouter plan
-        resp = llm_client.embeddings.create(model="text-embedding-3-small", input=text)
-        # response may be object-like or dict-like
-        if hasattr(resp, "data") and len(resp.data) > 0:
-            emb = resp.data[0].embedding
-            return list(emb)
-        elif isinstance(resp, dict) and "data" in resp and len(resp["data"]) > 0:
-            return list(resp["data"][0]["embedding"])
-        else:
-            print("Unexpected embeddings response:", type(resp))
-            return None
+        # cached per model + text (memory LRU, then the on-disk table), shared with chat retrieval
+        return await embed(text)
     except Exception as e:
         print("Embedding request failed:", e)
         return None
 
 
-def get_cached_template_embedding(slug: str) -> Optional[List[float]]:
+async def get_cached_template_embedding(slug: str) -> Optional[List[float]]:
     # return cached embedding if exists, else compute and cache
     if slug in EMBEDDING_CACHE:
         return EMBEDDING_CACHE[slug]
@@ -124,12 +107,19 @@ def get_cached_template_embedding(slug: str) -> Optional[List[float]]:
     text = (tpl.get("title", "") + " " + tpl.get("description", "")).strip()
     if not text:
         text = tpl.get("body", "")[:1000]  # fallback
-    emb = get_embedding_for_text(text)
+    emb = await get_embedding_for_text(text)
     if emb:
         EMBEDDING_CACHE[slug] = emb
     return emb
 
 
+async def get_template_embeddings() -> Dict[str, Optional[List[float]]]:
+    # the first request embeds the templates concurrently over the shared pool
+    slugs = [tpl.get("slug") for tpl in TEMPLATES]
+    embs = await asyncio.gather(*(get_cached_template_embedding(slug) for slug in slugs))
+    return dict(zip(slugs, embs))
+
+
 # --- Initialize templates (no heavy model load) ---
 safe_load_templates()
 
@@ -153,7 +143,7 @@ async def search_drafts(request: SearchRequest):
         return []
 
     # Get embedding for query
-    query_emb = get_embedding_for_text(query)
+    query_emb = await get_embedding_for_text(query)
     if query_emb is None:
         # Embedding failure — return basic keyword matches as fallback
         results = []
@@ -165,9 +155,10 @@ async def search_drafts(request: SearchRequest):
         return results[:3]
 
     scored = []
+    template_embs = await get_template_embeddings()
     for tpl in TEMPLATES:
         slug = tpl.get("slug")
-        emb = get_cached_template_embedding(slug)
+        emb = template_embs.get(slug)
         if emb is None:
             continue
         score = cos_sim(query_emb, emb)
@@ -186,14 +177,15 @@ async def generate_draft(request: DraftRequest):
         raise HTTPException(status_code=400, detail="Situation is required.")
 
     # compute query embedding
-    query_emb = get_embedding_for_text(situation)
+    query_emb = await get_embedding_for_text(situation)
     # find best template by similarity
     best_score = -1.0
     best_slug = None
     if query_emb is not None:
+        template_embs = await get_template_embeddings()
         for tpl in TEMPLATES:
             slug = tpl.get("slug")
-            emb = get_cached_template_embedding(slug)
+            emb = template_embs.get(slug)
             if emb is None:
                 continue
             score = cos_sim(query_emb, emb)
@@ -242,7 +234,7 @@ Rewrite the following draft template to match the user's situation **without rem
         raise HTTPException(status_code=500, detail="LLM client not configured on server.")
 
     try:
-        response = llm_client.chat.completions.create(
+        response = await llm_client.chat.completions.create(
             model="deepseek/deepseek-r1-0528:free",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.6,
@@ -8,6 +8,7 @@ import asyncio
 import httpx
 from dotenv import load_dotenv
 from typing import List, Tuple
+from llm import http_client
 
 
 
@@ -147,16 +148,15 @@ async def summarize_chunk_openrouter(chunk_text: str, length_hint: str = "concis
 
     headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
 
-    async with httpx.AsyncClient() as client:
-        resp = await _post_with_retries(client, OPENROUTER_API_URL, payload, headers)
-        data = resp.json()
-        # adapt to response structure if different
-        # expected: data["choices"][0]["message"]["content"]
-        try:
-            return data["choices"][0]["message"]["content"].strip()
-        except Exception:
-            # fallback if structure differs
-            return data.get("result", "").strip() or data.get("text", "").strip() or ""
+    resp = await _post_with_retries(http_client, OPENROUTER_API_URL, payload, headers)
+    data = resp.json()
+    # adapt to response structure if different
+    # expected: data["choices"][0]["message"]["content"]
+    try:
+        return data["choices"][0]["message"]["content"].strip()
+    except Exception:
+        # fallback if structure differs
+        return data.get("result", "").strip() or data.get("text", "").strip() or ""
 
 
 async def combine_summaries_openrouter(summaries: List[str], length_hint: str = "concise") -> str:
@@ -182,13 +182,12 @@ async def combine_summaries_openrouter(summaries: List[str], length_hint: str =
     }
 
     headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient() as client:
-        resp = await _post_with_retries(client, OPENROUTER_API_URL, payload, headers)
-        data = resp.json()
-        try:
-            return data["choices"][0]["message"]["content"].strip()
-        except Exception:
-            return data.get("result", "").strip() or data.get("text", "").strip() or ""
+    resp = await _post_with_retries(http_client, OPENROUTER_API_URL, payload, headers)
+    data = resp.json()
+    try:
+        return data["choices"][0]["message"]["content"].strip()
+    except Exception:
+        return data.get("result", "").strip() or data.get("text", "").strip() or ""
 
 
 # --- API Routes ---
@@ -0,0 +1,24 @@
+# scripts/build_case_index.py
+# Offline build of the case search snapshot that CaseIndex mmaps at startup.
+# Run from server/:  python -m scripts.build_case_index [cases.jsonl] [out_dir]
+# Also precomputes the similar-cases table (CASE_SIMILAR_TOP_N=0 skips it).
+import sys
+from pathlib import Path
+
+from utils.search import CaseIndex, DATA_DIR, SNAPSHOT_DIR
+from utils.similar import SIMILAR_TOP_N
+
+
+def main(argv):
+    src = Path(argv[1]) if len(argv) > 1 else DATA_DIR / "cases.sample.jsonl"
+    out = Path(argv[2]) if len(argv) > 2 else SNAPSHOT_DIR
+    idx = CaseIndex(src)
+    idx.fit()
+    if SIMILAR_TOP_N > 0:
+        idx.build_similar()
+    idx.save(out)
+    print(f"Wrote {len(idx.ids)} cases, {idx.mat.shape[1]} terms, {idx.mat.nnz} nnz -> {out}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
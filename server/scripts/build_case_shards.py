@@ -0,0 +1,41 @@
+# scripts/build_case_shards.py
+# Offline build of a sharded case index: one global TF-IDF fit, then the corpus
+# is partitioned by case id into N shards that share its vocabulary and IDF.
+# Similar cases and the citation graph are built over the whole corpus and kept
+# in out_dir/shared, where the serving parent answers those lookups.
+# Run from server/:  python -m scripts.build_case_shards N [cases.jsonl] [out_dir]
+# Serve with CASE_INDEX_SHARDS=N (and CASE_SHARD_DIR=out_dir if not the default).
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from utils.search import CaseIndex, DATA_DIR
+from utils.similar import SIMILAR_TOP_N
+from utils.shards import SHARD_DIR, shard_of
+
+
+def main(argv):
+    if len(argv) < 2:
+        print("usage: python -m scripts.build_case_shards N [cases.jsonl] [out_dir]")
+        return 1
+    n = int(argv[1])
+    src = Path(argv[2]) if len(argv) > 2 else DATA_DIR / "cases.sample.jsonl"
+    out = Path(argv[3]) if len(argv) > 3 else SHARD_DIR
+    idx = CaseIndex(src)
+    idx.fit()
+    if SIMILAR_TOP_N > 0:
+        idx.build_similar()
+    owner = np.fromiter((shard_of(cid, n) for cid in idx.ids), dtype=np.int32, count=len(idx.ids))
+    shutil.rmtree(out, ignore_errors=True)
+    # before the shards: a server reloading on their new snapshots must find these
+    idx.save_shared(out / "shared")
+    for i in range(n):
+        part = idx.shard(np.flatnonzero(owner == i), out / f"shard-{i}")
+        print(f"shard {i}: {len(part.ids)} cases -> {out / f'shard-{i}'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
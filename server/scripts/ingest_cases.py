@@ -0,0 +1,34 @@
+# scripts/ingest_cases.py
+# Daily ingestion of new judgments as delta segments (no full TF-IDF refit).
+# Run from server/:  python -m scripts.ingest_cases new_cases.jsonl [--compact]
+# Running servers pick the new segments up on their next reload check, and one of them
+# compacts the deltas in the background once they exceed CASE_INDEX_MERGE_ROWS.
+# --compact refits a new base here and now instead (e.g. with no server running).
+import json
+import sys
+
+from utils.search import CaseIndex, DATA_DIR, SNAPSHOT_DIR, MERGE_THRESHOLD
+
+
+def main(argv):
+    args = [a for a in argv[1:] if a != "--compact"]
+    if len(args) != 1:
+        print("usage: python -m scripts.ingest_cases new_cases.jsonl [--compact]")
+        return 1
+    with open(args[0], "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    idx = CaseIndex(DATA_DIR / "cases.sample.jsonl", SNAPSHOT_DIR)
+    idx.load()
+    fresh = [c for c in cases if c["id"] not in idx.store]
+    n = idx.append(fresh)
+    print(f"Appended {n} cases ({len(cases) - n} already indexed); {idx.delta_rows} rows in delta segments")
+    if "--compact" in argv and idx.deltas:
+        idx = idx.compact()
+        print(f"Compacted into a new base of {len(idx.ids)} cases -> {SNAPSHOT_DIR}")
+    elif idx.delta_rows >= MERGE_THRESHOLD:
+        print(f"Over CASE_INDEX_MERGE_ROWS={MERGE_THRESHOLD}: the server will compact them in the background")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,65 @@
+# Pruned BM25 (MaxScore) against brute-force scoring, with and without the authority blend.
+# Run from server/:  python -m pytest -q tests
+import numpy as np
+import pytest
+from scipy import sparse
+
+from utils.bm25 import BM25Index
+
+N_DOCS, N_TERMS, K = 3000, 400, 10
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(7)
+    # Zipf-ish term frequencies, so posting lists range from a handful of docs to most of them
+    p = 1.0 / np.arange(1, N_TERMS + 1) ** 1.1
+    p /= p.sum()
+    lengths = rng.integers(20, 200, N_DOCS)
+    rows = np.repeat(np.arange(N_DOCS), lengths)
+    cols = rng.choice(N_TERMS, size=len(rows), p=p)
+    counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(N_DOCS, N_TERMS))
+    counts.sum_duplicates()
+    idx = BM25Index.build(counts)
+    impacts = idx.impacts_for(counts).tocsc()
+    authority = rng.random(N_DOCS).astype(np.float32) ** 4
+    authority /= authority.max()
+    return idx, impacts, authority, rng
+
+
+def _top(docs, final, k):
+    order = np.lexsort((docs, -final))[:k]
+    return docs[order], final[order]
+
+
+@pytest.mark.parametrize("weight", [0.0, 0.5, 1.0])
+@pytest.mark.parametrize("filtered", [False, True])
+def test_pruned_topk_matches_brute_force(corpus, weight, filtered):
+    idx, impacts, authority, rng = corpus
+    for _ in range(100):
+        terms = rng.integers(0, N_TERMS, rng.integers(1, 6))
+        mask = rng.random(N_DOCS) < 0.3 if filtered else None
+        qtf = np.bincount(terms, minlength=N_TERMS).astype(np.float64)
+        full = impacts @ qtf
+        blend = 1 + weight * authority.astype(np.float64)
+        ok = full > 0 if mask is None else (full > 0) & mask
+        want_docs, want = _top(np.flatnonzero(ok), (full * blend)[ok], K)
+
+        docs, scores = idx.score(terms, K, mask, authority, weight, float(authority.max()))
+        assert np.all(np.diff(docs) > 0)
+        # every returned score is complete, never a partial sum
+        np.testing.assert_allclose(scores, full[docs], rtol=1e-9, atol=1e-9)
+        got_docs, got = _top(docs, scores * blend[docs], K)
+        np.testing.assert_allclose(got, want, rtol=1e-9, atol=1e-9)
+        # same documents, up to the order of exact ties
+        strict = want > want.min() + 1e-9
+        assert set(got_docs[got > want.min() + 1e-9].tolist()) == set(want_docs[strict].tolist())
+
+
+def test_pruning_scores_only_candidates(corpus):
+    idx, impacts, authority, _ = corpus
+    # two rare terms: the work (and the result) is bounded by their postings
+    rare = np.argsort(np.diff(impacts.indptr))[:2]
+    docs, _ = idx.score(rare, K)
+    postings = sum(int(idx.indptr[t + 1] - idx.indptr[t]) for t in rare)
+    assert len(docs) <= postings < N_DOCS
@@ -0,0 +1,146 @@
+# utils/bm25.py
+from pathlib import Path
+from typing import Optional, Tuple
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+
+class BM25Index:
+    """
+    BM25 over term-major posting lists stored as flat NumPy arrays:
+    postings of term t are docs[indptr[t]:indptr[t+1]] (ascending) with their
+    precomputed BM25 impacts, plus a per-term upper bound used for MaxScore
+    pruning in score().
+    """
+
+    def __init__(self, indptr, docs, impacts, upper, idf, avgdl: float, n_docs: int,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.indptr, self.docs, self.impacts, self.upper, self.idf = indptr, docs, impacts, upper, idf
+        self.avgdl, self.n_docs, self.k1, self.b = avgdl, n_docs, k1, b
+
+    @classmethod
+    def build(cls, counts: sparse.csr_matrix, k1: float = BM25_K1, b: float = BM25_B,
+              idf: Optional[np.ndarray] = None, avgdl: Optional[float] = None) -> "BM25Index":
+        """From a docs x terms raw term-count matrix; pass idf/avgdl to reuse global statistics (shards)."""
+        n, n_terms = counts.shape
+        if idf is None:
+            df = np.bincount(counts.indices, minlength=n_terms)
+            idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        dl = np.asarray(counts.sum(axis=1)).ravel()
+        if avgdl is None:
+            avgdl = float(dl.mean()) if n else 0.0
+        idx = cls(None, None, None, None, idf, avgdl, n, k1, b)
+        csc = idx.impacts_for(counts, dl).tocsc()
+        csc.sort_indices()
+        upper = np.zeros(n_terms, dtype=np.float32)
+        nonempty = np.diff(csc.indptr) > 0
+        if nonempty.any():
+            upper[nonempty] = np.maximum.reduceat(csc.data, csc.indptr[:-1][nonempty])
+        idx.indptr = csc.indptr.astype(np.int64)
+        idx.docs = csc.indices.astype(np.int32)
+        idx.impacts = csc.data.astype(np.float32)
+        idx.upper = upper
+        return idx
+
+    def impacts_for(self, counts: sparse.csr_matrix, dl: Optional[np.ndarray] = None) -> sparse.csr_matrix:
+        """BM25 impact of every (doc, term) count, against this index's idf/avgdl (also used for delta rows)."""
+        counts = counts.tocsr()
+        if dl is None:
+            dl = np.asarray(counts.sum(axis=1)).ravel()
+        tf = counts.data.astype(np.float32)
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        norm = self.k1 * (1 - self.b + self.b * dl[rows] / (self.avgdl or 1.0))
+        data = self.idf[counts.indices] * tf * (self.k1 + 1) / (tf + norm)
+        return sparse.csr_matrix((data.astype(np.float32), counts.indices, counts.indptr), shape=counts.shape)
+
+    def score(self, terms: np.ndarray, k: int, mask: Optional[np.ndarray] = None,
+              authority: Optional[np.ndarray] = None, weight: float = 0.0,
+              max_authority: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 scores of the candidate documents for the query terms (term ids,
+        repeats count) -> (docs ascending, scores). Lists are visited in
+        decreasing upper-bound order into an accumulator over the documents seen
+        so far. Once the k-th best candidate beats anything the remaining lists
+        could give an unseen document, no new document can enter the top-k: the
+        remaining (long, low-impact) lists only update the candidates, and
+        candidates that can no longer reach the top-k are dropped (MaxScore).
+        The cost follows the posting lengths, not the corpus size.
+
+        Ranking is by score * (1 + weight * authority[doc]) (the caller's
+        citation-authority blend; documents past the end of `authority` get 1),
+        and the bounds account for it. Returned scores are complete and
+        unblended; documents left out cannot make that top-k.
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        terms, qtf = np.unique(np.asarray(terms, dtype=np.int64), return_counts=True)
+        if not len(terms) or not self.n_docs:
+            return empty
+        boosted = authority is not None and weight > 0 and len(authority) > 0
+
+        def boost(docs: np.ndarray) -> np.ndarray:
+            out = np.ones(len(docs))
+            if boosted:
+                known = docs < len(authority)
+                out[known] += weight * np.asarray(authority[docs[known]], dtype=np.float64)
+            return out
+
+        ub = self.upper[terms].astype(np.float64) * qtf
+        order = np.argsort(-ub, kind="stable")
+        terms, qtf, ub = terms[order], qtf[order], ub[order]
+        rest = np.concatenate([np.cumsum(ub[::-1])[::-1], [0.0]])   # rest[j] = sum of ub[j:]
+        max_boost = 1.0 + weight * max_authority if boosted else 1.0
+        k = max(1, k)
+        docs, acc, mult = empty[0], empty[1], empty[1]   # candidates, partial scores, blend factors
+        theta = 0.0           # k-th best blended lower bound among the candidates
+        closed = False        # no new candidates past this point
+        for j, t in enumerate(terms):
+            a, b = self.indptr[t], self.indptr[t + 1]
+            if a == b: continue
+            pdocs = self.docs[a:b]
+            pimp = self.impacts[a:b].astype(np.float64) * qtf[j]
+            if not closed and theta > rest[j] * max_boost:
+                closed = True
+            if closed:
+                keep = (acc + rest[j]) * mult >= theta
+                docs, acc, mult = docs[keep], acc[keep], mult[keep]
+                pos = np.searchsorted(pdocs, docs)
+                pos[pos == len(pdocs)] = 0
+                hit = pdocs[pos] == docs
+                acc[hit] += pimp[pos[hit]]
+            else:
+                if mask is not None:
+                    keep = mask[pdocs]
+                    pdocs, pimp = pdocs[keep], pimp[keep]
+                docs, inv = np.unique(np.concatenate([docs, pdocs]), return_inverse=True)
+                acc = np.bincount(inv, weights=np.concatenate([acc, pimp]), minlength=len(docs))
+                mult = boost(docs)
+            if len(docs) > k:
+                lb = acc * mult
+                theta = float(np.partition(lb, len(lb) - k)[len(lb) - k])
+        return docs, acc
+
+    def matches(self, terms) -> np.ndarray:
+        """Sorted docs containing any of the terms (the exact match set, unaffected by pruning)."""
+        terms = np.unique(np.asarray(terms, dtype=np.int64))
+        parts = [self.docs[self.indptr[t]:self.indptr[t + 1]] for t in terms]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+
+    def save(self, d: Path):
+        d.mkdir(parents=True, exist_ok=True)
+        for name in ("indptr", "docs", "impacts", "upper", "idf"):
+            np.save(d / f"{name}.npy", getattr(self, name))
+        (d / "meta.json").write_text(json.dumps({
+            "avgdl": self.avgdl, "n_docs": self.n_docs, "k1": self.k1, "b": self.b,
+        }), encoding="utf-8")
+
+    @classmethod
+    def open(cls, d: Path) -> "BM25Index":
+        meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+        arrays = [np.load(d / f"{n}.npy", mmap_mode="r") for n in ("indptr", "docs", "impacts", "upper", "idf")]
+        return cls(*arrays, meta["avgdl"], meta["n_docs"], meta["k1"], meta["b"])
@@ -0,0 +1,162 @@
+# utils/case_columns.py
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import re
+
+import numpy as np
+from scipy import sparse
+
+# separators used inside the free-text `issues` field ("Criminal — NDPS — Section 37; Bail")
+ISSUE_SPLIT_RX = re.compile(r"\s*(?:;|—|–|\s-\s)\s*")
+
+
+def split_issues(issues: Optional[str]) -> List[str]:
+    return [t for t in ISSUE_SPLIT_RX.split(issues or "") if t.strip()]
+
+
+def _year(date: Optional[str]) -> int:
+    y = (date or "")[:4]
+    return int(y) if y.isdigit() else 0
+
+
+def _categorize(values: Iterable[str], names: Optional[List[str]] = None) -> Tuple[List[str], np.ndarray]:
+    """Map values to int32 codes, extending an existing category list in place."""
+    names = names if names is not None else []
+    lookup = {v: i for i, v in enumerate(names)}
+    codes = []
+    for v in values:
+        if v not in lookup:
+            lookup[v] = len(names); names.append(v)
+        codes.append(lookup[v])
+    return names, np.asarray(codes, dtype=np.int32)
+
+
+class CaseColumns:
+    """
+    Compact per-row case metadata (row order == CaseIndex.ids) so SearchFilters
+    can be evaluated as one vectorised boolean mask instead of a Python loop.
+    """
+
+    def __init__(self):
+        self.courts: List[str] = []
+        self.court: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.outcomes: List[str] = []
+        self.outcome: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.year: np.ndarray = np.zeros(0, dtype=np.int16)   # 0 == unknown
+        self.issue_tags: List[str] = []                       # lower-cased tag vocabulary
+        self.issues = sparse.csr_matrix((0, 0), dtype=np.bool_)  # rows x tags
+
+    def __len__(self):
+        return len(self.year)
+
+    @classmethod
+    def build(cls, cases: Iterable[Dict]) -> "CaseColumns":
+        cols = cls()
+        cols.extend(cases)
+        return cols
+
+    def extend(self, cases: Iterable[Dict]):
+        """Append rows for newly ingested cases (categories and tags grow as needed)."""
+        cases = list(cases)
+        _, court = _categorize((c.get("court") or "" for c in cases), self.courts)
+        _, outcome = _categorize((c.get("outcome") or "na" for c in cases), self.outcomes)
+        year = np.asarray([_year(c.get("date")) for c in cases], dtype=np.int16)
+        tags = {t: j for j, t in enumerate(self.issue_tags)}
+        indptr, indices = [0], []
+        for c in cases:
+            row = set()
+            for t in split_issues(c.get("issues")):
+                t = t.lower()
+                if t not in tags:
+                    tags[t] = len(self.issue_tags); self.issue_tags.append(t)
+                row.add(tags[t])
+            indices.extend(sorted(row)); indptr.append(len(indices))
+        width = len(self.issue_tags)
+        old = self.issues
+        old = sparse.csr_matrix((old.data, old.indices, old.indptr), shape=(old.shape[0], width))
+        new = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.bool_), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(cases), width),
+        )
+        self.court = np.concatenate([self.court, court])
+        self.outcome = np.concatenate([self.outcome, outcome])
+        self.year = np.concatenate([self.year, year])
+        self.issues = sparse.vstack([old, new], format="csr")
+
+    def save(self, d: Path):
+        d.mkdir(parents=True, exist_ok=True)
+        for name in ("court", "outcome", "year"):
+            np.save(d / f"{name}.npy", getattr(self, name))
+        np.save(d / "issues_indptr.npy", self.issues.indptr.astype(np.int32 if self.issues.nnz < 2**31 else np.int64))
+        np.save(d / "issues_indices.npy", self.issues.indices.astype(np.int32))
+        (d / "names.json").write_text(json.dumps(
+            {"courts": self.courts, "outcomes": self.outcomes, "issue_tags": self.issue_tags}, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def open(cls, d: Path) -> "CaseColumns":
+        cols = cls()
+        names = json.loads((d / "names.json").read_text(encoding="utf-8"))
+        cols.courts, cols.outcomes, cols.issue_tags = names["courts"], names["outcomes"], names["issue_tags"]
+        for name in ("court", "outcome", "year"):
+            setattr(cols, name, np.load(d / f"{name}.npy", mmap_mode="r"))
+        indptr = np.load(d / "issues_indptr.npy", mmap_mode="r")
+        indices = np.load(d / "issues_indices.npy", mmap_mode="r")
+        cols.issues = sparse.csr_matrix((np.ones(len(indices), dtype=np.bool_), indices, indptr),
+                                        shape=(len(indptr) - 1, len(cols.issue_tags)), copy=False)
+        return cols
+
+    def _code_mask(self, names: List[str], codes: np.ndarray, value: str) -> np.ndarray:
+        try:
+            return codes == names.index(value)
+        except ValueError:
+            return np.zeros(len(codes), dtype=bool)
+
+    def _issue_mask(self, issue: str) -> np.ndarray:
+        # every separator-delimited part of the filter must appear in one of the row's tags
+        mask = np.ones(len(self), dtype=bool)
+        for part in split_issues(issue.lower()) or [issue.lower()]:
+            cols = [j for j, t in enumerate(self.issue_tags) if part in t]
+            if not cols:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.issues[:, cols].getnnz(axis=1) > 0
+        return mask
+
+    def mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Boolean row mask for SearchFilters; None when no filter is set."""
+        filters = filters or {}
+        mask = None
+
+        def _and(m):
+            nonlocal mask
+            mask = m if mask is None else mask & m
+
+        if f := filters.get("court"):
+            _and(self._code_mask(self.courts, self.court, f))
+        if o := filters.get("outcome"):
+            _and(self._code_mask(self.outcomes, self.outcome, o))
+        yf, yt = _year(filters.get("yearFrom")), _year(filters.get("yearTo"))
+        # cases with an unknown year are not excluded by a year range
+        if yf:
+            _and((self.year >= yf) | (self.year == 0))
+        if yt:
+            _and((self.year <= yt) | (self.year == 0))
+        if issue := filters.get("issue"):
+            _and(self._issue_mask(issue))
+        return mask
+
+    def facet_counts(self, rows: np.ndarray) -> Dict[str, Dict[str, int]]:
+        """Court / year / outcome histograms over a set of rows (np.bincount over the code columns)."""
+        rows = np.asarray(rows, dtype=np.int64)
+
+        def named(names: List[str], codes: np.ndarray) -> Dict[str, int]:
+            counts = np.bincount(codes[rows], minlength=len(names))
+            order = np.argsort(-counts, kind="stable")
+            return {names[i] or "unknown": int(counts[i]) for i in order if counts[i]}
+
+        years = np.bincount(self.year[rows].astype(np.int64), minlength=1) if len(rows) else np.zeros(1, dtype=np.int64)
+        return {
+            "court": named(self.courts, self.court),
+            "year": {(str(y) if y else "unknown"): int(years[y]) for y in np.flatnonzero(years)},
+            "outcome": named(self.outcomes, self.outcome),
+        }
@@ -0,0 +1,377 @@
+# utils/case_store.py
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:   # optional fast path
+    orjson = None
+
+# fields kept resident per case: enough to build a CaseStub / filter without the judgment text
+STUB_FIELDS = ("id", "title", "court", "date", "outcome", "neutral_citation", "reporter_citations", "issues", "issues_split")
+HOT_CASES = int(os.getenv("CASE_STORE_CACHE", "256"))
+# bulk reads: lines closer than this are fetched with one pread (up to READ_MAX bytes)
+COALESCE_GAP = 16 << 10
+READ_MAX = 8 << 20
+
+
+def dumps(obj) -> bytes:
+    """Compact UTF-8 JSON (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def case_stub(c: Dict) -> Dict:
+    """The CaseStub fields of a case record or stub (everything but `why`)."""
+    return {
+        "id": c["id"],
+        "title": c.get("title", ""),
+        "court": c.get("court", ""),
+        "date": c.get("date", ""),
+        "outcome": c.get("outcome", "na"),
+        "neutral_citation": c.get("neutral_citation"),
+        "reporter_citations": c.get("reporter_citations"),
+        "issues": (c.get("issues_split") or c.get("issues") or "").split(";") if c.get("issues") else None,
+    }
+
+
+def stub_prefix(c: Dict) -> bytes:
+    """A CaseStub encoded as JSON minus its closing brace; see hit_json()."""
+    return dumps(case_stub(c))[:-1]
+
+
+def hit_json(prefix: bytes, why: Optional[str], snippets: Optional[List[str]] = None) -> bytes:
+    return prefix + b',"why":' + dumps(why) + b',"snippets":' + dumps(snippets) + b"}"
+
+
+class _Column:
+    """Per-row int64 values: a read-only (mmapped) base array plus an in-memory tail."""
+
+    def __init__(self, base: Optional[np.ndarray] = None):
+        self.base = base if base is not None else np.zeros(0, dtype=np.int64)
+        self.tail = array("q")
+
+    def __len__(self):
+        return len(self.base) + len(self.tail)
+
+    def __getitem__(self, row: int) -> int:
+        n = len(self.base)
+        return int(self.base[row]) if row < n else self.tail[row - n]
+
+    def append(self, v: int):
+        self.tail.append(v)
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Values for an array of rows (vectorised over the base)."""
+        n = len(self.base)
+        out = np.empty(len(rows), dtype=np.int64)
+        old = rows < n
+        out[old] = self.base[rows[old]]
+        if not old.all():
+            out[~old] = np.frombuffer(self.tail, dtype=np.int64)[rows[~old] - n]
+        return out
+
+    def values(self) -> np.ndarray:
+        return np.concatenate([self.base, np.frombuffer(self.tail, dtype=np.int64)])
+
+
+class _Blobs:
+    """Per-row byte strings: a base blob + offsets (mmapped) plus an in-memory tail list."""
+
+    def __init__(self, blob: Optional[np.ndarray] = None, ptr: Optional[np.ndarray] = None):
+        self.blob = blob if blob is not None else np.zeros(0, dtype=np.uint8)
+        self.ptr = ptr if ptr is not None else np.zeros(1, dtype=np.int64)
+        self.tail: List[bytes] = []
+
+    def __len__(self):
+        return len(self.ptr) - 1 + len(self.tail)
+
+    def __getitem__(self, row: int) -> bytes:
+        n = len(self.ptr) - 1
+        if row >= n:
+            return self.tail[row - n]
+        return self.blob[self.ptr[row]:self.ptr[row + 1]].tobytes()
+
+    def append(self, b: bytes):
+        self.tail.append(b)
+
+    def save(self, d: Path, name: str):
+        items = [self[i] for i in range(len(self))]
+        np.save(d / f"{name}_ptr.npy", np.concatenate([[0], np.cumsum([len(b) for b in items], dtype=np.int64)]).astype(np.int64))
+        (d / f"{name}.bin").write_bytes(b"".join(items))
+
+    @classmethod
+    def open(cls, d: Path, name: str) -> "_Blobs":
+        path = d / f"{name}.bin"
+        blob = np.memmap(path, dtype=np.uint8, mode="r") if path.stat().st_size else np.zeros(0, dtype=np.uint8)
+        return cls(blob, np.load(d / f"{name}_ptr.npy", mmap_mode="r"))
+
+
+def _id_hash(cid: str) -> int:
+    return int.from_bytes(hashlib.blake2b(cid.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class _Ids:
+    """
+    Case ids in row order with id -> row lookup. A saved table is the id blob + offsets
+    and the ids' 64-bit hashes sorted with their rows, all mmapped (shared by workers);
+    ids added after it sit in a list and a dict.
+    """
+
+    def __init__(self, base: Optional[_Blobs] = None, hashes: Optional[np.ndarray] = None,
+                 order: Optional[np.ndarray] = None):
+        self.base = base if base is not None else _Blobs()
+        self.hashes = hashes if hashes is not None else np.zeros(0, dtype=np.uint64)
+        self.order = order if order is not None else np.zeros(0, dtype=np.int64)
+        self.n_base = len(self.base)
+        self.tail: List[str] = []
+        self.tail_rows: Dict[str, int] = {}
+
+    def __len__(self):
+        return self.n_base + len(self.tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.base[i].decode("utf-8") if i < self.n_base else self.tail[i - self.n_base]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __contains__(self, cid: str):
+        return self.get(cid) is not None
+
+    def get(self, cid: str, default: Optional[int] = None) -> Optional[int]:
+        row = self.tail_rows.get(cid)
+        if row is not None:
+            return row
+        h = np.uint64(_id_hash(cid))
+        i, key = int(np.searchsorted(self.hashes, h)), cid.encode("utf-8")
+        while i < len(self.hashes) and self.hashes[i] == h:
+            row = int(self.order[i])
+            if self.base[row] == key:
+                return row
+            i += 1
+        return default
+
+    def append(self, cid: str):
+        self.tail_rows[cid] = len(self)
+        self.tail.append(cid)
+
+    def save(self, d: Path):
+        ids = [cid.encode("utf-8") for cid in self]
+        blobs = _Blobs()
+        blobs.tail = ids
+        blobs.save(d, "ids")
+        hashes = np.fromiter((_id_hash(cid) for cid in self), dtype=np.uint64, count=len(ids))
+        order = np.argsort(hashes, kind="stable")
+        np.save(d / "id_hashes.npy", hashes[order])
+        np.save(d / "id_rows.npy", order.astype(np.int64))
+
+    @classmethod
+    def open(cls, d: Path) -> "_Ids":
+        return cls(_Blobs.open(d, "ids"), np.load(d / "id_hashes.npy", mmap_mode="r"),
+                   np.load(d / "id_rows.npy", mmap_mode="r"))
+
+
+class CaseStore:
+    """
+    Judgments stay in the append-only JSONL on disk. Only an id -> byte range
+    table and a small stub per case are resident; full records are read with
+    pread on demand, with a bounded LRU of hot cases. A table saved with the
+    index snapshot is reopened mmapped, so worker processes share its pages.
+    """
+
+    def __init__(self, path: Path, cache_size: int = HOT_CASES):
+        self.path = Path(path)
+        self.ids = _Ids()           # row -> id, and id -> row via .get()
+        self.stubs = _Blobs()       # STUB_FIELDS of each case as JSON
+        self.stub_json = _Blobs()   # CaseStub encoded once per case, so result pages are concatenated
+        self.starts = _Column()     # byte offset of each row's line
+        self.ends = _Column()
+        self.size = 0               # bytes of the file covered by the table
+        self.cache_size = cache_size
+        self._hot: "OrderedDict[int, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+
+    @property
+    def rows(self) -> _Ids:
+        """id -> row lookups (.get / in) on the same table as ids."""
+        return self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, cid: str):
+        return cid in self.ids
+
+    def _add(self, c: Dict, start: int, end: int):
+        self.ids.append(c["id"])
+        stub = {k: c[k] for k in STUB_FIELDS if c.get(k) is not None}
+        self.stubs.append(dumps(stub))
+        self.stub_json.append(stub_prefix(stub))
+        self.starts.append(start); self.ends.append(end)
+
+    def scan(self, resume: bool = False) -> Iterator[Dict]:
+        """
+        (Re)build the table from the file, yielding each full record once so callers
+        can index it. With resume, keep the current table and read on from its end.
+        """
+        if not resume:
+            self.ids = _Ids()
+            self.stubs, self.stub_json, self.starts, self.ends = _Blobs(), _Blobs(), _Column(), _Column()
+            self.size = 0
+        self._hot.clear()
+        pos = self.size
+        with self.path.open("rb") as f:
+            f.seek(pos)
+            for line in f:
+                start, pos = pos, pos + len(line)
+                if not line.strip(): continue
+                c = json.loads(line)
+                self._add(c, start, pos)
+                yield c
+        self.size = pos
+
+    def iter_records(self) -> Iterator[Dict]:
+        """
+        Every record of the table in row order, read sequentially from the file and
+        parsed one at a time (the LRU is left alone). Used by fit() for its field passes.
+        """
+        pos = 0
+        with self.path.open("rb") as f:
+            for line in f:
+                if pos >= self.size: break
+                pos += len(line)
+                if line.strip():
+                    yield json.loads(line)
+
+    def save(self, d: Path):
+        d.mkdir(parents=True, exist_ok=True)
+        np.save(d / "starts.npy", self.starts.values())
+        np.save(d / "ends.npy", self.ends.values())
+        self.stubs.save(d, "stubs")
+        self.stub_json.save(d, "stub_json")
+        self.ids.save(d)
+
+    @classmethod
+    def open(cls, path: Path, d: Path, size: int, cache_size: int = HOT_CASES) -> "CaseStore":
+        """Attach a saved table covering the first `size` bytes of the file."""
+        store = cls(path, cache_size)
+        store.ids = _Ids.open(d)
+        store.starts = _Column(np.load(d / "starts.npy", mmap_mode="r"))
+        store.ends = _Column(np.load(d / "ends.npy", mmap_mode="r"))
+        store.stubs = _Blobs.open(d, "stubs")
+        store.stub_json = _Blobs.open(d, "stub_json")
+        store.size = size
+        return store
+
+    def append(self, cases: List[Dict]) -> int:
+        """Append records to the file and the table; returns the new covered size in bytes."""
+        lines = [(json.dumps(c, ensure_ascii=False) + "\n").encode("utf-8") for c in cases]
+        with self.path.open("ab+") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            if pos:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n"); pos += 1
+            f.write(b"".join(lines))
+        for c, line in zip(cases, lines):
+            self._add(c, pos, pos + len(line))
+            pos += len(line)
+        self.size = pos
+        return pos
+
+    def _file(self) -> int:
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDONLY)
+            return self._fd
+
+    def _read(self, row: int) -> Dict:
+        start = self.starts[row]
+        return json.loads(os.pread(self._file(), self.ends[row] - start, start))
+
+    def records(self, rows: List[int]) -> List[Dict]:
+        """
+        Full records for many rows, in the order given. Hot rows come from the LRU;
+        the rest are read in file order, with nearby lines coalesced into one pread.
+        Bulk reads do not populate the LRU.
+        """
+        out: List[Optional[Dict]] = [None] * len(rows)
+        with self._lock:
+            for i, row in enumerate(rows):
+                out[i] = self._hot.get(row)
+        todo = np.asarray([i for i, c in enumerate(out) if c is None], dtype=np.int64)
+        if not len(todo):
+            return out
+        picked = np.asarray(rows, dtype=np.int64)[todo]
+        starts, ends = self.starts.take(picked), self.ends.take(picked)
+        order = np.argsort(starts, kind="stable")
+        todo, starts, ends = todo[order].tolist(), starts[order].tolist(), ends[order].tolist()
+        fd = self._file()
+        j = 0
+        while j < len(todo):
+            lo, hi, k = starts[j], ends[j], j + 1
+            while k < len(todo) and starts[k] - hi <= COALESCE_GAP and max(hi, ends[k]) - lo <= READ_MAX:
+                hi = max(hi, ends[k]); k += 1
+            buf = os.pread(fd, hi - lo, lo)
+            for i in range(j, k):
+                out[todo[i]] = json.loads(buf[starts[i] - lo:ends[i] - lo])
+            j = k
+        return out
+
+    def record(self, row: int) -> Dict:
+        """Full case record for a row (judgment text included)."""
+        with self._lock:
+            c = self._hot.get(row)
+            if c is not None:
+                self._hot.move_to_end(row)
+                return c
+        c = self._read(row)
+        if self.cache_size > 0:
+            with self._lock:
+                self._hot[row] = c
+                while len(self._hot) > self.cache_size:
+                    self._hot.popitem(last=False)
+        return c
+
+    def get(self, cid: str) -> Optional[Dict]:
+        row = self.rows.get(cid)
+        return None if row is None else self.record(row)
+
+    def stub_at(self, row: int) -> Dict:
+        return json.loads(self.stubs[row])
+
+    def stub(self, cid: str) -> Optional[Dict]:
+        row = self.rows.get(cid)
+        return None if row is None else self.stub_at(row)
+
+    def stub_bytes(self, cid: str) -> Optional[bytes]:
+        row = self.rows.get(cid)
+        return None if row is None else self.stub_json[row]
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
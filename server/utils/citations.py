@@ -0,0 +1,176 @@
+# utils/citations.py
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import json
+import re
+
+import numpy as np
+from scipy import sparse
+
+# Indian reporter citations: AIR, SCC, SCC OnLine and SCR forms
+CITE_RX = re.compile(r"((?:AIR\s+(?:19|20)\d{2}\s+[A-Z]{2,}\s+\d+)|\((?:19|20)\d{2}\)\s+\d+\s+SCC\s+\d+|\b\d{4}\s+SCC\s+OnLine\s+[A-Za-z.()]+\s+\d+\b|\((?:19|20)\d{2}\)\s+\d+\s+SCR\s+\d+)")
+# same forms, tolerant of how users type them ("(2019) 5 scc 123")
+_CITE_RX_I = re.compile(CITE_RX.pattern, re.IGNORECASE)
+
+
+def normalize_citation(cite: str) -> str:
+    """Canonical lookup key: single spaces, upper case ("2021 SCC OnLine SC 456" -> "2021 SCC ONLINE SC 456")."""
+    return re.sub(r"\s+", " ", cite or "").strip().upper()
+
+
+def extract_citations(text: str) -> List[str]:
+    """All citation keys found in free text, in order of appearance, without duplicates."""
+    seen: Dict[str, None] = {}
+    for m in _CITE_RX_I.finditer(text or ""):
+        seen.setdefault(normalize_citation(m.group(1)), None)
+    return list(seen)
+
+
+def case_citations(case: Dict) -> List[str]:
+    """Citation keys a case is reported under (reporter + neutral)."""
+    reps = list(case.get("reporter_citations") or [])
+    if case.get("neutral_citation"):
+        reps.append(case["neutral_citation"])
+    keys: Dict[str, None] = {}
+    for r in reps:
+        # a reporter string may carry parallel citations ("(2019) 5 SCC 123 : AIR 2019 SC 1")
+        found = extract_citations(r) or [normalize_citation(r)]
+        for k in found:
+            if k: keys.setdefault(k, None)
+    return list(keys)
+
+
+class CitationIndex:
+    """Normalised citation key -> case rows, for O(1) exact citation lookups."""
+
+    def __init__(self):
+        self.rows: Dict[str, List[int]] = {}
+
+    @classmethod
+    def build(cls, cases: Iterable[Dict]) -> "CitationIndex":
+        idx = cls()
+        idx.add(cases)
+        return idx
+
+    def add(self, cases: Iterable[Dict], start: int = 0):
+        """Index cases occupying rows start, start+1, ..."""
+        for i, c in enumerate(cases, start):
+            for k in case_citations(c):
+                self.rows.setdefault(k, []).append(i)
+
+    def save(self, d: Path):
+        d.mkdir(parents=True, exist_ok=True)
+        (d / "citations.json").write_text(json.dumps(self.rows, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def open(cls, d: Path) -> "CitationIndex":
+        idx = cls()
+        idx.rows = json.loads((d / "citations.json").read_text(encoding="utf-8"))
+        return idx
+
+    def lookup(self, cite: str) -> List[int]:
+        return self.rows.get(normalize_citation(cite), [])
+
+    def hits(self, q: str) -> List[int]:
+        """Rows for every citation mentioned in the query (not just the first)."""
+        out: Dict[int, None] = {}
+        for k in extract_citations(q):
+            for i in self.rows.get(k, ()):
+                out.setdefault(i, None)
+        return list(out)
+
+
+class CitationGraph:
+    """
+    Case-to-case citation graph as two CSR adjacency tables (cites / citedBy)
+    plus a PageRank-style authority score per case. Rows are CaseIndex rows.
+    """
+
+    def __init__(self, cites: Tuple[np.ndarray, np.ndarray], cited_by: Tuple[np.ndarray, np.ndarray],
+                 authority: np.ndarray):
+        self.cites = cites          # (indptr, indices) of each direction; mmapped when opened
+        self.cited_by = cited_by
+        self.authority = authority
+        self.max_authority = float(authority.max()) if len(authority) else 0.0
+
+    @property
+    def rows(self) -> int:
+        return len(self.cites[0]) - 1
+
+    @classmethod
+    def build(cls, cited_keys: List[List[str]], index: CitationIndex, damping: float = 0.85) -> "CitationGraph":
+        """`cited_keys[i]` are the citation keys extracted from case i's text."""
+        n = len(cited_keys)
+        # flatten (src, key) pairs, then resolve each distinct key once
+        src = np.repeat(np.arange(n, dtype=np.int64), [len(k) for k in cited_keys])
+        flat = [k for keys in cited_keys for k in keys]
+        uniq, inv = np.unique(np.asarray(flat, dtype=object), return_inverse=True) if flat else (np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64))
+        targets = [index.rows.get(k, []) for k in uniq]
+        per_key = np.fromiter((len(t) for t in targets), dtype=np.int64, count=len(targets))
+        key_dst = np.fromiter((r for t in targets for r in t), dtype=np.int64, count=int(per_key.sum()))
+        key_ptr = np.concatenate([[0], np.cumsum(per_key)])
+        # expand every (src, key) into (src, dst) for each case reported under that key
+        reps = per_key[inv] if len(inv) else np.zeros(0, dtype=np.int64)
+        e_src = np.repeat(src, reps)
+        offs = np.arange(int(reps.sum())) - np.repeat(np.cumsum(reps) - reps, reps)
+        e_dst = key_dst[np.repeat(key_ptr[inv], reps) + offs] if len(offs) else np.zeros(0, dtype=np.int64)
+        keep = e_src != e_dst   # a judgment quoting its own citation is not an edge
+        cites = sparse.csr_matrix(
+            (np.ones(int(keep.sum()), dtype=np.float32), (e_src[keep], e_dst[keep])), shape=(n, n)
+        )
+        cites.sum_duplicates()
+        cites.data[:] = 1
+        cited_by = cites.T.tocsr()
+        return cls((cites.indptr, cites.indices), (cited_by.indptr, cited_by.indices), pagerank(cites, damping))
+
+    def subset(self, rows: np.ndarray) -> "CitationGraph":
+        """
+        The graph restricted to `rows` (renumbered 0..len(rows)-1, e.g. a shard): edges
+        between them, and their authority as computed over the whole graph.
+        """
+        (cp, ci), n = self.cites, self.rows
+        cites = sparse.csr_matrix((np.ones(len(ci), dtype=np.float32), np.asarray(ci), np.asarray(cp)), shape=(n, n))
+        cites = cites[rows][:, rows].tocsr()
+        cited_by = cites.T.tocsr()
+        return CitationGraph((cites.indptr, cites.indices), (cited_by.indptr, cited_by.indices),
+                             np.asarray(self.authority)[rows])
+
+    def neighbours(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows this case cites, rows citing it); empty for rows added after the build."""
+        if row >= self.rows:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty
+        (cp, ci), (bp, bi) = self.cites, self.cited_by
+        return ci[cp[row]:cp[row + 1]], bi[bp[row]:bp[row + 1]]
+
+    def save(self, d: Path):
+        # both directions are stored, so opening is a few mmaps (no per-worker transpose)
+        d.mkdir(parents=True, exist_ok=True)
+        for prefix, (indptr, indices) in (("", self.cites), ("by_", self.cited_by)):
+            np.save(d / f"{prefix}indptr.npy", np.asarray(indptr, dtype=np.int64))
+            np.save(d / f"{prefix}indices.npy", np.asarray(indices, dtype=np.int32))
+        np.save(d / "authority.npy", np.asarray(self.authority, dtype=np.float32))
+
+    @classmethod
+    def open(cls, d: Path) -> "CitationGraph":
+        cites, cited_by = ((np.load(d / f"{p}indptr.npy", mmap_mode="r"), np.load(d / f"{p}indices.npy", mmap_mode="r"))
+                           for p in ("", "by_"))
+        return cls(cites, cited_by, np.load(d / "authority.npy", mmap_mode="r"))
+
+
+def pagerank(adj: sparse.csr_matrix, damping: float = 0.85, tol: float = 1e-8, max_iter: int = 100) -> np.ndarray:
+    """Power-iteration PageRank over a (src -> dst) adjacency matrix, scaled so the top case is 1.0."""
+    n = adj.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    out_deg = np.asarray(adj.sum(axis=1)).ravel()
+    dangling = out_deg == 0
+    inv = np.divide(1.0, out_deg, out=np.zeros(n), where=~dangling)
+    at = adj.T.tocsr()
+    r = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        nxt = damping * (at @ (r * inv)) + (damping * r[dangling].sum() + 1.0 - damping) / n
+        done = np.abs(nxt - r).sum() < tol
+        r = nxt
+        if done: break
+    return (r / r.max()).astype(np.float32)
@@ -0,0 +1,157 @@
+# utils/dense.py
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import os
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# embedding size (0 = no dense index), summary vocabulary, IVF size threshold and probes
+DENSE_DIM = int(os.getenv("CASE_DENSE_DIM", "128"))
+DENSE_VOCAB = int(os.getenv("CASE_DENSE_VOCAB", "20000"))
+IVF_MIN_ROWS = int(os.getenv("CASE_DENSE_IVF_MIN_ROWS", "50000"))
+NPROBE = int(os.getenv("CASE_DENSE_NPROBE", "16"))
+SCAN_BLOCK = 65_536
+
+
+def summary_text(c: Dict) -> str:
+    """What the dense side embeds: the headnote-like fields, or the start of the judgment."""
+    parts = [c.get("title") or "", c.get("issues") or "", c.get("ratio_summary") or "",
+             " ".join(c.get("statutes") or [])]
+    if not (c.get("ratio_summary") or c.get("issues")):
+        parts.append((c.get("text") or "")[:2000])
+    return " \n ".join(parts)
+
+
+def _quantize(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes and scales (x ~= codes * scale)."""
+    scale = np.abs(x).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    return np.round(x / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+
+class DenseIndex:
+    """
+    Local dense retriever over case summaries: LSA embeddings (TF-IDF ->
+    TruncatedSVD, unit length) stored as int8 codes with a per-row scale.
+    Large corpora get an IVF layout (k-means lists, codes stored list-major)
+    and a query scans only the NPROBE nearest lists; small ones are scanned flat.
+    Rows appended after the build are kept in a small flat tail.
+    """
+
+    def __init__(self, vect: TfidfVectorizer, components: np.ndarray, codes: np.ndarray, scale: np.ndarray,
+                 centroids: np.ndarray, list_ptr: np.ndarray, list_rows: np.ndarray):
+        self.vect, self.components = vect, components
+        self.codes, self.scale = codes, scale                # list-major order
+        self.centroids, self.list_ptr, self.list_rows = centroids, list_ptr, list_rows
+        self._tail: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    @property
+    def rows(self) -> int:
+        return len(self.list_rows)
+
+    def __len__(self):
+        """Rows covered, including the appended tail."""
+        return self.rows + sum(len(codes) for codes, _ in self._tail)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], dim: int = DENSE_DIM) -> Optional["DenseIndex"]:
+        vect = TfidfVectorizer(max_features=DENSE_VOCAB, sublinear_tf=True, stop_words="english")
+        try:
+            tfidf = vect.fit_transform(texts)
+        except ValueError:   # empty vocabulary
+            return None
+        dim = min(dim, tfidf.shape[1] - 1, tfidf.shape[0] - 1)
+        if dim < 1:
+            return None
+        svd = TruncatedSVD(n_components=dim, random_state=0)
+        emb = svd.fit_transform(tfidf).astype(np.float32)
+        components = svd.components_.astype(np.float32)
+        emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        n = emb.shape[0]
+        if n >= IVF_MIN_ROWS:
+            km = MiniBatchKMeans(n_clusters=int(np.sqrt(n)), random_state=0, n_init=1, batch_size=4096)
+            assign = km.fit_predict(emb)
+            centroids = km.cluster_centers_.astype(np.float32)
+        else:
+            assign, centroids = np.zeros(n, dtype=np.int64), np.zeros((1, dim), dtype=np.float32)
+        order = np.argsort(assign, kind="stable")
+        list_ptr = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))]).astype(np.int64)
+        codes, scale = _quantize(emb[order])
+        return cls(vect, components, codes, scale, centroids, list_ptr, order.astype(np.int64))
+
+    def subset(self, rows: np.ndarray) -> "DenseIndex":
+        """
+        The embeddings of `rows` renumbered 0..len(rows)-1 (e.g. a shard), sharing this
+        index's projection and IVF lists so scores stay comparable across subsets.
+        """
+        local = np.full(self.rows, -1, dtype=np.int64)
+        local[rows] = np.arange(len(rows))
+        mapped = local[self.list_rows]
+        keep = mapped >= 0   # list-major order is kept, so each list stays contiguous
+        lists = np.repeat(np.arange(len(self.centroids)), np.diff(self.list_ptr))
+        list_ptr = np.concatenate([[0], np.cumsum(np.bincount(lists[keep], minlength=len(self.centroids)))]).astype(np.int64)
+        return DenseIndex(self.vect, self.components, self.codes[keep], self.scale[keep], self.centroids,
+                          list_ptr, mapped[keep])
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        v = np.asarray(self.vect.transform(texts) @ self.components.T, dtype=np.float32)
+        return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+
+    def extend(self, texts: List[str]):
+        """Embed newly appended cases (they take the rows right after the current tail)."""
+        self._tail.append(_quantize(self.encode(texts)))
+
+    def _scan(self, qv: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        out = np.empty(hi - lo, dtype=np.float32)
+        for a in range(lo, hi, SCAN_BLOCK):
+            b = min(hi, a + SCAN_BLOCK)
+            out[a - lo:b - lo] = (self.codes[a:b].astype(np.float32) @ qv) * self.scale[a:b]
+        return out
+
+    def search(self, q: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (rows, cosine scores) for a query, best first; rows outside `mask` are dropped."""
+        qv = self.encode([q])[0]
+        if not qv.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(self.centroids) > 1:
+            probe = np.argsort(-(self.centroids @ qv))[:NPROBE]
+        else:
+            probe = np.zeros(1, dtype=np.int64)
+        rows = [self.list_rows[self.list_ptr[l]:self.list_ptr[l + 1]] for l in probe]
+        scores = [self._scan(qv, int(self.list_ptr[l]), int(self.list_ptr[l + 1])) for l in probe]
+        start = self.rows
+        for codes, scale in self._tail:
+            rows.append(np.arange(start, start + len(codes)))
+            scores.append((codes.astype(np.float32) @ qv) * scale)
+            start += len(codes)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        keep = scores > 0   # orthogonal or opposite: unrelated
+        if mask is not None:
+            keep &= mask[rows]
+        rows, scores = rows[keep], scores[keep]
+        top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.lexsort((rows[top], -scores[top]))]
+        return rows[top], scores[top]
+
+    def save(self, d: Path):
+        d.mkdir(parents=True, exist_ok=True)
+        terms = [""] * len(self.vect.vocabulary_)
+        for t, col in self.vect.vocabulary_.items():
+            terms[col] = t
+        (d / "vocab.json").write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+        np.save(d / "idf.npy", self.vect.idf_.astype(np.float64))
+        for name in ("components", "codes", "scale", "centroids", "list_ptr", "list_rows"):
+            np.save(d / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def open(cls, d: Path) -> "DenseIndex":
+        terms = json.loads((d / "vocab.json").read_text(encoding="utf-8"))
+        vect = TfidfVectorizer(vocabulary={t: i for i, t in enumerate(terms)}, sublinear_tf=True, stop_words="english")
+        vect.idf_ = np.load(d / "idf.npy")
+        arrays = [np.load(d / f"{n}.npy", mmap_mode="r")
+                  for n in ("components", "codes", "scale", "centroids", "list_ptr", "list_rows")]
+        return cls(vect, *arrays)
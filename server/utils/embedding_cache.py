@@ -0,0 +1,85 @@
+# utils/embedding_cache.py
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+import hashlib
+import logging
+import sqlite3
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by sha256(model, text): a small in-process LRU in front of
+    a SQLite table of float32 blobs. The table is shared by every worker on the
+    host (WAL mode), so a text embedded once is never sent upstream again.
+    A disk failure only costs the cache, never the request.
+    """
+
+    def __init__(self, path: Path, capacity: int = 4096):
+        self.capacity = capacity
+        self._lru: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+            self._db = db
+        except sqlite3.Error:
+            logger.exception("Embedding cache at %s unavailable; memory tier only", path)
+
+    def _remember(self, key: bytes, emb: List[float]):
+        self._lru[key] = emb
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        with self._lock:
+            emb = self._lru.get(key)
+            if emb is not None:
+                self._lru.move_to_end(key)
+                return emb
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                logger.exception("Embedding cache read failed")
+                return None
+            if row is None:
+                return None
+            emb = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self._remember(key, emb)
+            return emb
+
+    def put(self, model: str, text: str, emb: List[float]):
+        key = cache_key(model, text)
+        with self._lock:
+            self._remember(key, emb)
+            if self._db is None:
+                return
+            try:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                                     (key, np.asarray(emb, dtype=np.float32).tobytes()))
+            except sqlite3.Error:
+                logger.exception("Embedding cache write failed")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,91 +1,1142 @@
 # utils/search_index.py
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-import re, json
+from typing import Dict, Iterable, List, Tuple, Optional, get_args
+import base64, json, os, re, shutil, logging, hashlib, threading, itertools, time
+
+try:
+    import fcntl
+except ImportError:   # Windows dev machines: no cross-process snapshot lock
+    fcntl = None
 
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from models.Case import SearchFilters, SearchMode
+from utils.citations import CITE_RX, CitationIndex, CitationGraph, case_citations, extract_citations
+from utils.case_columns import CaseColumns
+from utils.case_store import CaseStore
+from utils.similar import NeighbourTable, SIMILAR_TOP_N
+from utils.bm25 import BM25Index
+from utils.query_cache import TTLCache
+from utils.dense import DenseIndex, DENSE_DIM, summary_text
+from utils.typeahead import Typeahead, SUGGEST_LIMIT
+from utils.snippets import PassageTable, SNIPPETS_PER_HIT, best_spans, highlight, query_words, word_pattern
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+# Offline-built snapshot (see scripts/build_case_index.py); overridable per deployment.
+SNAPSHOT_DIR = Path(os.getenv("CASE_INDEX_DIR", str(DATA_DIR / "case_index")))
+SNAPSHOT_VERSION = 6
+# Once this many rows sit in delta segments, a server worker compacts them into a fresh
+# base in the background (see merge_in_background); scripts/ingest_cases.py --compact forces it.
+MERGE_THRESHOLD = int(os.getenv("CASE_INDEX_MERGE_ROWS", "5000"))
+# Scoring backend for "all" queries: "tfidf" (cosine over the full matrix) or "bm25"
+# (pruned posting lists). A bm25 deployment must also build its snapshot with it set.
+SEARCH_BACKEND = os.getenv("CASE_SEARCH_BACKEND", "tfidf").lower()
+# Hybrid search: reciprocal rank fusion constant, depth taken from each ranking,
+# and the threads running the dense side next to the lexical one.
+RRF_K = int(os.getenv("CASE_RRF_K", "60"))
+RRF_DEPTH = int(os.getenv("CASE_RRF_DEPTH", "100"))
+_dense_pool = ThreadPoolExecutor(max_workers=int(os.getenv("CASE_DENSE_THREADS", "4")), thread_name_prefix="case-dense")
+# Memory budget for one block of dense batch-query scores (rows x queries float64).
+BATCH_BLOCK_BYTES = int(os.getenv("CASE_BATCH_BLOCK_MB", "256")) << 20
+# Default weight of the citation-graph authority score blended into TF-IDF scores (0 = off).
+AUTHORITY_WEIGHT = float(os.getenv("CASE_AUTHORITY_WEIGHT", "0"))
+# Records are indexed in chunks of this many while the JSONL is scanned; only the chunk
+# in flight is held in memory (fit() then re-streams the file once per field it builds).
+LOAD_CHUNK = 50_000
+
+# Shared result cache for /cases/search; entries are tagged with CaseIndex.generation.
+query_cache = TTLCache(
+    maxsize=int(os.getenv("CASE_SEARCH_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CASE_SEARCH_CACHE_TTL", "300")),
+)
+_generations = itertools.count(1)
+
+def _norm_query(q: str) -> str:
+    # scoring is case- and whitespace-insensitive, so equivalent queries share cache entries
+    return re.sub(r"\s+", " ", q).strip().lower()
+
+def _cache_key(q: str, mode: str, top_k: int, authority: float, filters: Optional[Dict]):
+    return (_norm_query(q), mode, top_k, authority,
+            tuple(sorted((k, v) for k, v in (filters or {}).items() if v)))
+
+def _case_blob(c: Dict) -> str:
+    return " \n ".join([
+        c.get("title",""), c.get("court",""), c.get("date",""),
+        " ".join(c.get("reporter_citations",[]) or []),
+        c.get("neutral_citation","") or "",
+        c.get("issues","") or "",
+        c.get("ratio_summary","") or "",
+        c.get("text","") or "",
+    ])
+
+def _parties_blob(c: Dict) -> str:
+    p = c.get("parties") or {}
+    return " \n ".join([c.get("title","") or "", *(p.get("appellant") or []), *(p.get("respondent") or [])])
+
+def _citation_blob(c: Dict) -> str:
+    return " \n ".join(case_citations(c))
+
+def _facts_blob(c: Dict) -> str:
+    return " \n ".join([
+        c.get("issues","") or "",
+        c.get("ratio_summary","") or "",
+        " ".join(c.get("statutes",[]) or []),
+        c.get("text","") or "",
+    ])
+
+# SearchMode -> (document builder, vectoriser overrides). Each mode gets its own
+# sparse index so e.g. a parties query only scores the small parties matrix.
+FIELDS = {
+    "all": (_case_blob, {}),
+    "parties": (_parties_blob, {"max_features": 50_000}),
+    # keep single-digit volumes ("(2019) 5 SCC 123") and score citation n-grams
+    "citation": (_citation_blob, {"max_features": 50_000, "ngram_range": (1,3), "token_pattern": r"(?u)\b\w+\b"}),
+    "facts": (_facts_blob, {}),
+}
+
+def _new_vectorizer(mode: str = "all", **kw) -> TfidfVectorizer:
+    opts = {"max_features": 100_000, "ngram_range": (1,2), "lowercase": True, **FIELDS[mode][1], **kw}
+    return TfidfVectorizer(**opts)
+
+def _field_dir(d: Path, mode: str) -> Path:
+    # the "all" index sits at the root of a snapshot/segment, the others under fields/
+    return d if mode == "all" else d / "fields" / mode
+
+def _file_id(path: Path) -> List[int]:
+    st = path.stat()
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+def _prefix_sha1(path: Path, sizes: Iterable[int]) -> Dict[int, Optional[str]]:
+    """
+    SHA-1 of the first `size` bytes of the corpus file, for each size, from one sequential
+    read (the digest is taken at each boundary); None for sizes past the end of the file.
+    """
+    want = sorted(set(sizes))
+    out: Dict[int, Optional[str]] = dict.fromkeys(want)
+    h, pos = hashlib.sha1(), 0
+    with path.open("rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        for size in want:
+            if size > end: break
+            while pos < size:
+                buf = f.read(min(1 << 20, size - pos))
+                h.update(buf)
+                pos += len(buf)
+            out[size] = h.hexdigest()
+    return out
+
+def _source_stamp(path: Path, size: int) -> Dict:
+    """Identify the first `size` bytes of the (append-only) corpus, plus the file's identity now."""
+    return {"size": size, "sha1": _prefix_sha1(path, [size])[size], "file": _file_id(path)}
+
+def _sources_unchanged(path: Path, stamps: List[Dict]) -> List[bool]:
+    """
+    Whether each stamp (base, then segments) still describes the corpus. If the file's
+    (inode, size, mtime) are those recorded with the newest stamp, nothing was written since,
+    and its writer had verified the older ones: no read at all. Otherwise the prefixes are
+    re-hashed in one pass.
+    """
+    try:
+        now = _file_id(path)
+    except FileNotFoundError:
+        return [False] * len(stamps)
+    if stamps and max(stamps, key=lambda s: s.get("size", 0)).get("file") == now:
+        return [True] * len(stamps)
+    logger.info("%s changed since the case index snapshot was written; re-hashing it", path)
+    sha1 = _prefix_sha1(path, [s.get("size", 0) for s in stamps])
+    return [s.get("sha1") is not None and s.get("sha1") == sha1[s.get("size", 0)] for s in stamps]
+
+def _write_json(p: Path, obj):
+    p.write_text(json.dumps(obj), encoding="utf-8")
+
+def _read_json(p: Path):
+    return json.loads(p.read_text(encoding="utf-8"))
+
+def _save_csr(d: Path, mat: sparse.csr_matrix):
+    np.save(d / "data.npy", mat.data.astype(np.float64))
+    np.save(d / "indices.npy", mat.indices.astype(np.int32))
+    # int32 offsets while they fit: scipy would otherwise downcast (copy) an int64
+    # indptr on open, and each worker would hold its own copy
+    np.save(d / "indptr.npy", mat.indptr.astype(np.int32 if mat.nnz < 2**31 else np.int64))
+
+def _open_csr(d: Path, shape) -> sparse.csr_matrix:
+    data, indices, indptr = (np.load(d / f"{n}.npy", mmap_mode="r") for n in ("data", "indices", "indptr"))
+    # copy=False keeps the buffers backed by the page cache, shared across workers
+    return sparse.csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+
+_locks_held = threading.local()
+
+def _segment_metas(seg_root: Path) -> List[Tuple[Path, Dict]]:
+    """(directory, meta) of each complete delta segment, in row order."""
+    out = []
+    for seg in sorted(seg_root.iterdir()) if seg_root.is_dir() else []:
+        if seg.name.startswith("."): continue   # a writer's temporary directory
+        try:
+            out.append((seg, _read_json(seg / "meta.json")))
+        except FileNotFoundError:
+            continue   # half-written segment
+    return out
 
-CITE_RX = re.compile(r"((?:AIR\s+(?:19|20)\d{2}\s+[A-Z]{2,}\s+\d+)|\((?:19|20)\d{2}\)\s+\d+\s+SCC\s+\d+|\b\d{4}\s+SCC\s+OnLine\s+[A-Za-z.()]+\s+\d+\b|\((?:19|20)\d{2}\)\s+\d+\s+SCR\s+\d+)")
+@contextmanager
+def _snapshot_lock(d: Path, shared: bool = False):
+    """
+    Cross-process lock on a snapshot directory (no-op where fcntl is unavailable): shared
+    for readers attaching to it, exclusive for writers. Re-entrant within a thread, so
+    load() can save() while it holds the exclusive lock.
+    """
+    path = d.with_name(d.name + ".lock")
+    held = _locks_held.__dict__.setdefault("modes", {})
+    if fcntl is None or held.get(path) == "ex" or (shared and path in held):
+        yield
+        return
+    if path in held:
+        raise RuntimeError(f"cannot upgrade the shared lock on {d} to exclusive")
+    d.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        held[path] = "sh" if shared else "ex"
+        try:
+            yield
+        finally:
+            del held[path]
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _snapshot_stamp(d: Path) -> Tuple[int, ...]:
+    """Changes whenever a snapshot is replaced (new meta.json) or a segment is added to it."""
+    out = []
+    for p in (d / "meta.json", d / "segments"):
+        try:
+            st = p.stat()
+            out += [st.st_ino, st.st_mtime_ns]
+        except FileNotFoundError:
+            out += [0, 0]
+    return tuple(out)
+
+def _replace_dir(tmp: Path, dest: Path):
+    # swap directories so a reader never sees a half-written snapshot
+    old = dest.with_name(dest.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if dest.exists():
+        dest.rename(old)
+    tmp.rename(dest)
+    shutil.rmtree(old, ignore_errors=True)
 
 class CaseIndex:
-    def __init__(self, jsonl_path: Path):
+    """
+    TF-IDF case index made of a base segment (fitted, usually mmapped from a
+    snapshot) plus append-only delta segments vectorised against the base's
+    frozen vocabulary. Queries fan out over all segments; compact() refits
+    everything into a new base. Every segment holds one matrix per SearchMode
+    field family (see FIELDS).
+    """
+
+    def __init__(self, jsonl_path: Path, snapshot_dir: Optional[Path] = None, backend: str = SEARCH_BACKEND):
         self.path = jsonl_path
-        self.cases: Dict[str, Dict] = {}
-        self.ids: List[str] = []
-        self.docs: List[str] = []
-        self.vect = TfidfVectorizer(max_features=100_000, ngram_range=(1,2), lowercase=True)
-        self.mat = None
+        self.snapshot_dir = snapshot_dir
+        self.backend = backend
+        self.store = CaseStore(jsonl_path)
+        self.vects: Dict[str, TfidfVectorizer] = {}
+        self.base: Dict[str, sparse.csr_matrix] = {}            # mode -> base matrix
+        self.deltas: List[Dict[str, sparse.csr_matrix]] = []    # delta segments, in row order
+        self.citations = CitationIndex()
+        self.columns = CaseColumns()
+        self.similar: Optional[NeighbourTable] = None   # precomputed "similar cases" (base rows)
+        self.graph: Optional[CitationGraph] = None      # citations extracted from judgment text (base rows)
+        self.bm25: Optional[BM25Index] = None           # BM25 postings of the base "all" field
+        self.passages: Optional[PassageTable] = None    # snippet passages of the judgment text (base rows)
+        self.typeahead = Typeahead()                     # title / party / citation prefixes
+        self.dense: Optional[DenseIndex] = None          # LSA embeddings of case summaries (hybrid mode)
+        self._counter: Optional[CountVectorizer] = None
+        self._base_bytes = 0
+        self._persisted_rows = 0                 # rows covered by base + on-disk segments
+        self.generation = next(_generations)     # changes whenever the searchable rows do
+        self.snapshot_stamp: Optional[Tuple[int, ...]] = None   # of the snapshot this index opened
+
+    @property
+    def vect(self) -> TfidfVectorizer:
+        return self.vects["all"]
+
+    @property
+    def mat(self) -> sparse.csr_matrix:
+        return self.base["all"]
+
+    @property
+    def ids(self) -> List[str]:
+        return self.store.ids
+
+    @property
+    def source_bytes(self) -> int:
+        """Bytes of the JSONL covered by ids."""
+        return self.store.size
+
+    def get_case(self, cid: str) -> Optional[Dict]:
+        """Full case record, read from disk on demand."""
+        return self.store.get(cid)
+
+    def get_cases(self, cids: List[str]) -> List[Optional[Dict]]:
+        """Full records for many ids in one ordered bulk read (None for unknown ids)."""
+        rows = [self.store.rows.get(cid) for cid in cids]
+        found = [r for r in rows if r is not None]
+        recs = iter(self.store.records(found))
+        return [None if r is None else next(recs) for r in rows]
+
+    def stub(self, cid: str) -> Optional[Dict]:
+        """Resident stub fields of a case (no judgment text)."""
+        return self.store.stub(cid)
+
+    def suggest(self, q: str, limit: int = SUGGEST_LIMIT) -> List[Dict]:
+        """Typeahead: titles, party names and citations starting with q, most popular first."""
+        return [{"text": text, "kind": kind, "case_id": self.ids[row] if kind != "party" else None, "score": w}
+                for text, kind, row, w in self.typeahead.suggest(q, limit)]
+
+    def snippets_for(self, q: str, cids: List[str], n: int = SNIPPETS_PER_HIT) -> Dict[str, List[str]]:
+        """
+        Best-matching passages of each case's judgment text with the query words in <mark>.
+        Texts are fetched in one coalesced store.records() read (bypassing the record LRU),
+        and the result is cached next to the query's own entry for this generation.
+        """
+        key = ("snippets", _norm_query(q), tuple(cids), n)
+        hit = query_cache.get(key, self.generation)
+        if hit is not None:
+            return dict(hit)
+        words = query_words(self.vect.build_analyzer(), q)
+        vocab = self.vect.vocabulary_
+        terms = np.array(sorted({vocab[w] for w in words if w in vocab}), dtype=np.int64)
+        weights = self.vect.idf_[terms] if len(terms) else np.zeros(0)
+        rx = word_pattern(words)
+        plan: List[Tuple[str, int, Optional[List]]] = []
+        for cid in cids:
+            row = self.store.rows.get(cid)
+            if row is None: continue
+            if self.passages is not None and row < self.passages.rows:
+                plan.append((cid, row, self.passages.best(row, terms, weights, n)))
+            else:   # appended after the table was built: spans come from the text itself
+                plan.append((cid, row, None))
+        need = [row for _, row, spans in plan if spans is None or spans]
+        texts = {row: c.get("text") or "" for row, c in zip(need, self.store.records(need))} if need else {}
+        out: Dict[str, List[str]] = {}
+        for cid, row, spans in plan:
+            text = texts.get(row, "")
+            out[cid] = highlight(text, best_spans(text, rx, n) if spans is None else spans, rx)
+        query_cache.put(key, self.generation, out)
+        return dict(out)
+
+    def stub_json(self, cid: str) -> Optional[bytes]:
+        """Pre-encoded CaseStub JSON of a case, minus its closing brace (see case_store.hit_json)."""
+        return self.store.stub_bytes(cid)
+
+    def similar_cases(self, cid: str) -> List[Tuple[Dict, float]]:
+        """(stub, score) of the precomputed nearest neighbours of a case."""
+        row = self.store.rows.get(cid)
+        if row is None or self.similar is None:
+            return []
+        rows, scores = self.similar.neighbours(row)
+        return [(self.store.stub_at(r), float(s)) for r, s in zip(rows.tolist(), scores.tolist())]
+
+    def citation_links(self, cid: str) -> Dict[str, List[Dict]]:
+        """CaseDoc.citations from the citation graph: stubs of cases this one cites / is cited by."""
+        row = self.store.rows.get(cid)
+        if row is None or self.graph is None:
+            return {"cites": [], "citedBy": []}
+        cites, cited_by = self.graph.neighbours(row)
+        return {
+            "cites": [self.store.stub_at(r) for r in cites.tolist()],
+            "citedBy": [self.store.stub_at(r) for r in cited_by.tolist()],
+        }
+
+    def build_similar(self, top_n: int = SIMILAR_TOP_N) -> NeighbourTable:
+        """Compute the nearest-neighbour table of the base rows (offline; see save())."""
+        self.similar = NeighbourTable.build(self.mat, top_n)
+        return self.similar
+
+    def _read_cases(self, on_chunk=None, resume: bool = False):
+        """
+        Stream the JSONL into the case store, citation index, metadata columns and
+        typeahead. With resume, keep the (snapshot) tables and read only the rest of the file.
+        """
+        if not resume:
+            self.store.close()
+            self.store = CaseStore(self.path)
+            self.citations, self.columns, self.typeahead = CitationIndex(), CaseColumns(), Typeahead()
+        chunk: List[Dict] = []
+
+        def flush():
+            if not chunk: return
+            start = len(self.store) - len(chunk)
+            self.citations.add(chunk, start)
+            self.columns.extend(chunk)
+            self.typeahead.add(chunk, start)
+            if on_chunk: on_chunk(chunk)
+            chunk.clear()
+
+        for c in self.store.scan(resume):
+            chunk.append(c)
+            if len(chunk) >= LOAD_CHUNK: flush()
+        flush()
+
+    def fit(self):
+        """
+        Parse the JSONL and fit the TF-IDF model from scratch (slow path). Each vectorizer,
+        the BM25 counts, the passage table and the dense index read the store in their own
+        sequential pass, so no list of per-case texts is ever built.
+        """
+        cited: List[List[str]] = []
+        self._read_cases(lambda chunk: cited.extend(extract_citations(c.get("text") or "") for c in chunk))
+
+        def stream(field):
+            return (field(c) for c in self.store.iter_records())
+
+        # resolved only now: a judgment may cite one that appears later in the file
+        self.graph = CitationGraph.build(cited, self.citations)
+        self.typeahead.set_authority(self.graph.authority)
+        self.vects, self.base, self.deltas = {}, {}, []
+        self.bm25 = self._counter = None
+        for mode, (blob, _) in FIELDS.items():
+            vect = _new_vectorizer(mode)
+            try:
+                mat = vect.fit_transform(stream(blob)).tocsr()
+            except ValueError:
+                if mode == "all": raise
+                logger.info("No terms for %s field; %s queries fall back to the full index", mode, mode)
+                continue
+            self.vects[mode], self.base[mode] = vect, mat
+            if mode == "all" and self.backend == "bm25":
+                self.bm25 = BM25Index.build(self._term_counter().transform(stream(blob)))
+        self.passages = PassageTable.build(stream(lambda c: c.get("text") or ""), self.vect.vocabulary_)
+        self.dense = DenseIndex.build(stream(summary_text)) if DENSE_DIM > 0 else None
+        self._base_bytes = self.source_bytes
+        self._persisted_rows = 0
 
     def load(self):
-        self.cases.clear(); self.ids.clear(); self.docs.clear()
-        with self.path.open("r", encoding="utf-8") as f:
-            for line in f:
-                c = json.loads(line)
-                self.cases[c["id"]] = c
-                self.ids.append(c["id"])
-                blob = " \n ".join([
-                    c.get("title",""), c.get("court",""), c.get("date",""),
-                    " ".join(c.get("reporter_citations",[]) or []),
-                    c.get("neutral_citation","") or "",
-                    c.get("issues","") or "",
-                    c.get("ratio_summary","") or "",
-                    c.get("text","") or "",
-                ])
-                self.docs.append(blob)
-        self.mat = self.vect.fit_transform(self.docs)
+        """
+        Open the prebuilt snapshot (+ delta segments) if it matches the corpus, otherwise
+        refit and write the snapshot. Workers attach under a shared file lock, so they open a
+        valid snapshot in parallel; only a worker that has to fit takes it exclusively, and
+        the others then wait and attach its files.
+        """
+        self.generation = next(_generations)
+        if not self.snapshot_dir:
+            self.fit()
+            return
+        with _snapshot_lock(Path(self.snapshot_dir), shared=True):
+            if self._open_snapshot(self.snapshot_dir):
+                return
+        with _snapshot_lock(Path(self.snapshot_dir)):
+            if self._open_snapshot(self.snapshot_dir):
+                return   # another worker fitted it while we waited
+            self.fit()
+            try:
+                self.save(self.snapshot_dir)
+            except OSError:
+                logger.exception("Could not write case index snapshot to %s; serving from memory", self.snapshot_dir)
+                return
+            # reattach from disk so the arrays are mmapped (and shared with other workers)
+            if not self._open_snapshot(self.snapshot_dir):
+                self.fit()
+
+    @property
+    def delta_rows(self) -> int:
+        return sum(d["all"].shape[0] for d in self.deltas)
+
+    def _segments(self, mode: str = "all"):
+        """(first row, matrix) for the base and every delta segment of one field index."""
+        start = 0
+        for seg in [self.base, *self.deltas]:
+            m = seg[mode]
+            yield start, m
+            start += m.shape[0]
+
+    def _vectorize(self, cases: List[Dict]) -> Dict[str, sparse.csr_matrix]:
+        mats = {mode: v.transform([FIELDS[mode][0](c) for c in cases]).tocsr() for mode, v in self.vects.items()}
+        if self.bm25 is not None:
+            # raw counts; BM25 impacts are derived at query time from the base statistics
+            mats["bm25"] = self._term_counter().transform([_case_blob(c) for c in cases]).tocsr()
+        return mats
+
+    def _term_counter(self) -> CountVectorizer:
+        """Raw term counts over the "all" vocabulary, for BM25."""
+        if self._counter is None:
+            v = self.vect
+            self._counter = CountVectorizer(vocabulary=v.vocabulary_, ngram_range=v.ngram_range,
+                                            lowercase=v.lowercase, token_pattern=v.token_pattern)
+        return self._counter
+
+    # --- snapshot ---
+    def save(self, out_dir: Path):
+        """Write vocabulary, IDF, CSR buffers and ids so workers can mmap them instead of refitting."""
+        with _snapshot_lock(Path(out_dir)):
+            return self._save(Path(out_dir))
+
+    def _save(self, out_dir: Path):
+        if self.deltas:
+            raise RuntimeError("CaseIndex has delta segments; compact() it instead of saving")
+        tmp = out_dir.with_name(out_dir.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for mode, vect in self.vects.items():
+            d = _field_dir(tmp, mode)
+            d.mkdir(parents=True, exist_ok=True)
+            terms = [""] * len(vect.vocabulary_)
+            for t, col in vect.vocabulary_.items():
+                terms[col] = t
+            np.save(d / "idf.npy", vect.idf_.astype(np.float64))
+            _save_csr(d, self.base[mode].tocsr())
+            _write_json(d / "vocab.json", terms)
+        _write_json(tmp / "ids.json", list(self.ids))
+        if len(self.ids) == self.mat.shape[0]:
+            # per-row tables, so loading the snapshot does not re-read the corpus
+            t = tmp / "tables"
+            self.store.save(t)
+            self.columns.save(t)
+            self.citations.save(t)
+            self.typeahead.save(t)
+        if self.similar is not None and self.similar.rows == self.mat.shape[0]:
+            self.similar.save(tmp / "similar", self.ids)
+        if self.graph is not None and self.graph.rows == self.mat.shape[0]:
+            self.graph.save(tmp / "graph")
+        if self.bm25 is not None:
+            self.bm25.save(tmp / "bm25")
+        if self.passages is not None and self.passages.rows == self.mat.shape[0]:
+            self.passages.save(tmp / "passages")
+        if self.dense is not None and self.dense.rows == self.mat.shape[0]:
+            self.dense.save(tmp / "dense")
+        _write_json(tmp / "meta.json", {
+            "version": SNAPSHOT_VERSION,
+            "fields": {mode: list(m.shape) for mode, m in self.base.items()},
+            "source": _source_stamp(self.path, self._base_bytes),
+        })
+        _replace_dir(tmp, out_dir)
+        return out_dir
+
+    def stale(self) -> bool:
+        """True once the snapshot on disk is not the one this index opened (rebuilt or appended to elsewhere)."""
+        return self.snapshot_stamp is not None and _snapshot_stamp(Path(self.snapshot_dir)) != self.snapshot_stamp
+
+    def _open_snapshot(self, d: Path) -> bool:
+        # called under the snapshot lock, so the stamp matches what is read below
+        self.snapshot_stamp = _snapshot_stamp(Path(d))
+        try:
+            meta = _read_json(d / "meta.json")
+        except FileNotFoundError:
+            return False
+        src = meta.get("source") or {}
+        segments = _segment_metas(d / "segments")
+        unchanged = _sources_unchanged(self.path, [src, *(m["source"] for _, m in segments)])
+        if meta.get("version") != SNAPSHOT_VERSION or not unchanged[0]:
+            logger.warning("Case index snapshot at %s is stale; refitting from %s", d, self.path)
+            return False
+        self.vects, self.base, self.deltas = {}, {}, []
+        for mode, shape in meta["fields"].items():
+            fd = _field_dir(d, mode)
+            terms = _read_json(fd / "vocab.json")
+            vect = _new_vectorizer(mode, vocabulary={t: i for i, t in enumerate(terms)})
+            vect.idf_ = np.load(fd / "idf.npy")
+            self.vects[mode], self.base[mode] = vect, _open_csr(fd, shape)
+        self._base_bytes = src["size"]
+        n = self.mat.shape[0]
+        t = d / "tables"
+        if (t / "stub_json.bin").exists():
+            self.store.close()
+            self.store = CaseStore.open(self.path, t, self._base_bytes)
+            self.columns, self.citations, self.typeahead = CaseColumns.open(t), CitationIndex.open(t), Typeahead.open(t)
+            self._read_cases(resume=True)   # rows appended after the snapshot
+        else:
+            self._read_cases()
+            if self.ids[:n] != _read_json(d / "ids.json"):
+                logger.warning("Case index snapshot ids do not match %s; refitting", self.path)
+                return False
+        self.similar = NeighbourTable.open(d / "similar") if (d / "similar" / "indptr.npy").exists() else None
+        self.graph = CitationGraph.open(d / "graph") if (d / "graph" / "indptr.npy").exists() else None
+        self.typeahead.set_authority(self.graph.authority if self.graph is not None else None)
+        self.passages = PassageTable.open(d / "passages") if (d / "passages" / "case_ptr.npy").exists() else None
+        self.dense = DenseIndex.open(d / "dense") if DENSE_DIM > 0 and (d / "dense" / "codes.npy").exists() else None
+        self.bm25 = self._counter = None
+        if self.backend == "bm25":
+            if (d / "bm25" / "meta.json").exists():
+                self.bm25 = BM25Index.open(d / "bm25")
+            else:
+                logger.warning("Snapshot at %s has no BM25 postings; using TF-IDF scoring", d)
+        self._open_segments(segments, unchanged[1:])
+        return True
+
+    def _open_segments(self, segments: List[Tuple[Path, Dict]], unchanged: List[bool]):
+        covered = self.mat.shape[0]
+        for (seg, meta), ok in zip(segments, unchanged):
+            if (meta["start"] != covered or not ok
+                    or (self.bm25 is not None and "bm25" not in meta["fields"])
+                    or self.ids[covered:covered + meta["rows"]] != _read_json(seg / "ids.json")):
+                logger.warning("Case index segment %s does not match the corpus; re-vectorising from row %d", seg, covered)
+                break
+            self.deltas.append({
+                mode: _open_csr(_field_dir(seg, mode), shape) for mode, shape in meta["fields"].items()
+                if mode in self.vects or (mode == "bm25" and self.bm25 is not None)
+            })
+            covered += meta["rows"]
+        self._persisted_rows = covered
+        if covered < len(self.ids):
+            # rows appended to the JSONL without going through append(): vectorise them in memory
+            tail = [self.store.record(i) for i in range(covered, len(self.ids))]
+            self.deltas.append(self._vectorize(tail))
+            logger.info("Vectorised %d unindexed cases from %s against the frozen vocabulary", len(tail), self.path)
+
+    # --- incremental ingestion ---
+    def append(self, cases: List[Dict]) -> int:
+        """
+        Append new judgments: write them to the JSONL, vectorise them against the
+        frozen vocabulary into a delta segment and (with a snapshot) persist it.
+        Terms unseen by the base only become searchable after compact().
+        """
+        cases = [c for c in cases if c]
+        ids = [c["id"] for c in cases]
+        dup = [i for i in ids if i in self.store]
+        if dup or len(set(ids)) != len(ids):
+            raise ValueError(f"Duplicate case ids: {dup or ids}")
+        if not cases: return 0
+
+        start = len(self.ids)
+        mats = self._vectorize(cases)
+        self.store.append(cases)
+        self.citations.add(cases, start)
+        self.columns.extend(cases)
+        self.typeahead.add(cases, start)
+        if self.dense is not None and len(self.dense) == start:
+            self.dense.extend([summary_text(c) for c in cases])
+        self.deltas.append(mats)
+        self.generation = next(_generations)
+        if self.snapshot_dir and self._persisted_rows == start:
+            self._save_segment(start, ids, mats)
+        return len(cases)
+
+    def _save_segment(self, start: int, ids: List[str], mats: Dict[str, sparse.csr_matrix]):
+        with _snapshot_lock(Path(self.snapshot_dir)):
+            self._write_segment(start, ids, mats)
+            # our own segment: not a reason to reload
+            self.snapshot_stamp = _snapshot_stamp(Path(self.snapshot_dir))
+
+    def _write_segment(self, start: int, ids: List[str], mats: Dict[str, sparse.csr_matrix]):
+        seg_root = Path(self.snapshot_dir) / "segments"
+        seg_root.mkdir(parents=True, exist_ok=True)
+        seg = seg_root / f"{start:012d}"
+        tmp = seg_root / f".{start:012d}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        for mode, mat in mats.items():
+            d = _field_dir(tmp, mode)
+            d.mkdir(parents=True, exist_ok=True)
+            _save_csr(d, mat)
+        _write_json(tmp / "ids.json", ids)
+        # meta.json last: a segment without it is ignored by readers
+        _write_json(tmp / "meta.json", {
+            "start": start, "rows": len(ids), "fields": {mode: list(m.shape) for mode, m in mats.items()},
+            "source": _source_stamp(self.path, self.source_bytes),
+        })
+        _replace_dir(tmp, seg)
+        self._persisted_rows = start + len(ids)
+
+    def shard(self, rows: np.ndarray, out_dir: Path) -> "CaseIndex":
+        """
+        Write the given base rows as a standalone shard (JSONL + snapshot) that
+        keeps this index's vocabularies and IDF, so scores from different shards
+        are comparable. The shard gets its rows' authority scores, dense
+        embeddings and snippet passages; similar cases and citation links cross
+        shards, so those lookups are answered from save_shared()'s tables.
+        """
+        if self.deltas:
+            raise RuntimeError("CaseIndex has delta segments; compact() it before sharding")
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / "cases.jsonl"
+        records = [self.store.record(int(r)) for r in rows]
+        path.write_bytes(b"".join((json.dumps(c, ensure_ascii=False) + "\n").encode("utf-8") for c in records))
+        part = CaseIndex(path, out_dir / "index", self.backend)
+        part._read_cases()
+        part.vects = self.vects
+        part.base = {mode: m[rows] for mode, m in self.base.items()}
+        if self.bm25 is not None:
+            counts = self._term_counter().transform([_case_blob(c) for c in records])
+            part.bm25 = BM25Index.build(counts, self.bm25.k1, self.bm25.b, self.bm25.idf, self.bm25.avgdl)
+        if self.graph is not None:
+            part.graph = self.graph.subset(rows)
+            part.typeahead.set_authority(part.graph.authority)
+        if self.dense is not None:
+            part.dense = self.dense.subset(rows)
+        part.passages = PassageTable.build((c.get("text") or "" for c in records), self.vect.vocabulary_)
+        part._base_bytes = part.source_bytes
+        part.save(part.snapshot_dir)
+        return part
+
+    def save_shared(self, out_dir: Path):
+        """
+        Write the tables that span shards (ids, similar cases, citation graph, in this
+        index's rows) for ShardedCaseIndex, which answers those lookups itself.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.store.ids.save(out_dir)
+        if self.similar is not None:
+            self.similar.save(out_dir / "similar", self.ids)
+        if self.graph is not None:
+            self.graph.save(out_dir / "graph")
+
+    def compact(self) -> "CaseIndex":
+        """Refit base + deltas into a new index (and snapshot); returns the new index."""
+        fresh = CaseIndex(self.path, self.snapshot_dir)
+        fresh.fit()
+        if self.similar is not None and SIMILAR_TOP_N > 0:
+            fresh.build_similar()
+        if self.snapshot_dir:
+            fresh.save(self.snapshot_dir)
+            fresh = CaseIndex(self.path, self.snapshot_dir)
+            fresh.load()   # picks up anything appended while we were fitting
+        return fresh
+
+    def validate(self):
+        """Raise ValueError unless ids, field indexes and columns line up and a probe query runs."""
+        n = len(self.ids)
+        if not n:
+            raise ValueError("case index is empty")
+        for mode in self.vects:
+            rows = sum(m.shape[0] for _, m in self._segments(mode))
+            if rows != n:
+                raise ValueError(f"{mode} index covers {rows} rows, case store has {n}")
+        if len(self.columns) != n:
+            raise ValueError(f"case columns cover {len(self.columns)} rows, case store has {n}")
+        stub = self.stub(self.ids[0]) or {}
+        self._query(stub.get("title") or self.ids[0], None, 1, "all")
+
+    def close(self):
+        self.store.close()
+
+    def _score(self, qv, rows: np.ndarray, mode: str = "all") -> np.ndarray:
+        """
+        Cosine scores for the (sorted) rows, fanned out over base and delta segments.
+        One query vector gives a 1-D array; a matrix of m queries gives (rows x m).
+        """
+        # rows and query are L2-normalised, so the dot product is the cosine
+        # (and avoids re-normalising a copy of the whole matrix per query)
+        sims = np.zeros((len(rows), qv.shape[0]))
+        for start, m in self._segments(mode):
+            lo, hi = np.searchsorted(rows, [start, start + m.shape[0]])
+            if lo == hi: continue
+            part = rows[lo:hi] - start
+            if len(part) * 2 < m.shape[0]:
+                sims[lo:hi] = (m[part] @ qv.T).toarray()   # score only the filtered rows
+            else:
+                sims[lo:hi] = (m @ qv.T).toarray()[part]
+        return sims.ravel() if qv.shape[0] == 1 else sims
+
+    def _bm25_terms(self, q: str) -> List[int]:
+        vocab = self.vect.vocabulary_
+        return [t for t in (vocab.get(w) for w in self._term_counter().build_analyzer()(q)) if t is not None]
+
+    def _score_bm25(self, q: str, mask: Optional[np.ndarray], top_k: int, authority: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (rows, BM25 scores) of the candidates: pruned posting-list scoring on the base
+        (exact for the top-k under the authority blend), brute force on the small deltas.
+        """
+        terms = self._bm25_terms(q)
+        n_base = self.bm25.n_docs
+        graph = self.graph if authority and self.graph is not None else None
+        rows, sims = self.bm25.score(terms, top_k, None if mask is None else mask[:n_base],
+                                     graph.authority if graph else None, authority,
+                                     graph.max_authority if graph else 0.0)
+        rows, sims = [rows], [sims]
+        if self.deltas and terms:
+            qvec = np.bincount(terms, minlength=len(self.bm25.idf)).astype(np.float32)
+            start = n_base
+            for d in self.deltas:
+                s = self.bm25.impacts_for(d["bm25"]) @ qvec
+                r = np.flatnonzero(s)
+                if mask is not None:
+                    r = r[mask[start + r]]
+                rows.append(start + r); sims.append(s[r].astype(np.float64))
+                start += d["bm25"].shape[0]
+        return np.concatenate(rows), np.concatenate(sims)
+
+    def _pad_rows(self, rows: np.ndarray, sims: np.ndarray, mask: Optional[np.ndarray], k: int):
+        """
+        Fewer candidates than k (short or empty query): fill up with the lowest
+        unscored rows that pass the filters, as a full scoring pass would rank them.
+        """
+        if len(rows) >= k:
+            return rows, sims
+        pool = np.arange(min(len(self.ids), k + len(rows))) if mask is None else np.flatnonzero(mask)[:k + len(rows)]
+        extra = np.setdiff1d(pool, rows)[:k - len(rows)]
+        rows = np.concatenate([rows, extra])
+        sims = np.concatenate([sims, np.zeros(len(extra))])
+        order = np.argsort(rows, kind="stable")
+        return rows[order], sims[order]
 
     def _exact_citation_hits(self, q: str) -> List[int]:
-        m = CITE_RX.search(q)
-        if not m: return []
-        cite = m.group(1)
-        hits = []
-        for i, cid in enumerate(self.ids):
-            c = self.cases[cid]
-            reps = (c.get("reporter_citations") or []) + ([c.get("neutral_citation")] if c.get("neutral_citation") else [])
-            if any(cite in r for r in reps):
-                hits.append(i)
-        return hits
-
-    def query(self, q: str, filters: Optional[Dict] = None, top_k: int = 25):
-        filters = filters or {}
-        qv = self.vect.transform([q])
-        sims = cosine_similarity(qv, self.mat).ravel()
-        idxs = np.argsort(-sims)[: top_k + 50]
-        reasons = {i: "TF-IDF match" for i in idxs if sims[i] > 0}
-
-        # exact citation boost
-        exact = self._exact_citation_hits(q)
-        for i in exact:
-            reasons[i] = "Exact citation match"
-            sims[i] = max(sims[i], 1.5)
-
-        def passes(i: int) -> bool:
-            c = self.cases[self.ids[i]]
-            if f := filters.get("court"):
-                if c.get("court") != f: return False
-            yf, yt = filters.get("yearFrom"), filters.get("yearTo")
-            if yf or yt:
-                y = (c.get("date","") or "")[:4]
-                if yf and y and y < yf: return False
-                if yt and y and y > yt: return False
-            if issue := filters.get("issue"):
-                if issue.lower() not in (c.get("issues","") or "").lower(): return False
-            if out := filters.get("outcome"):
-                if c.get("outcome") != out: return False
-            return True
-
-        kept = [i for i in idxs if passes(i)]
-        kept.sort(key=lambda i: -sims[i])
-        return [(self.ids[i], sims[i], reasons.get(i, "match")) for i in kept[:top_k]]
+        return self.citations.hits(q)
+
+    def query(self, q: str, filters: Optional[Dict] = None, top_k: int = 25, mode: str = "all",
+              authority: Optional[float] = None):
+        """
+        Top-k (id, score, why) for q; `mode` restricts scoring to one field index (or,
+        "hybrid", fuses the full lexical ranking with the dense one), `authority` blends
+        in the citation-graph authority score (default AUTHORITY_WEIGHT).
+        """
+        mode = self._mode(mode)
+        authority = AUTHORITY_WEIGHT if authority is None else authority
+        key = _cache_key(q, mode, top_k, authority, filters)
+        hit = query_cache.get(key, self.generation)
+        if hit is not None:
+            return list(hit)
+        out, _ = self._query(q, filters, top_k, mode, authority)
+        query_cache.put(key, self.generation, tuple(out))
+        return out
+
+    def query_faceted(self, q: str, filters: Optional[Dict] = None, top_k: int = 25, mode: str = "all",
+                      authority: Optional[float] = None):
+        """query() plus court / year / outcome counts over every matching case (not just the top-k)."""
+        mode = self._mode(mode)
+        authority = AUTHORITY_WEIGHT if authority is None else authority
+        key = _cache_key(q, mode, top_k, authority, filters) + ("facets",)
+        hit = query_cache.get(key, self.generation)
+        if hit is not None:
+            return list(hit[0]), hit[1]
+        out, matched = self._query(q, filters, top_k, mode, authority, with_matched=True)
+        facets = self.columns.facet_counts(matched)
+        query_cache.put(key, self.generation, (tuple(out), facets))
+        return out, facets
+
+    def _mode(self, mode: str) -> str:
+        if mode in self.vects or (mode == "hybrid" and self.dense is not None):
+            return mode
+        return "all"
+
+    def _query(self, q: str, filters: Optional[Dict], top_k: int, mode: str, authority: float = 0.0,
+               with_matched: bool = False):
+        """(top-k hits, matched rows); matched rows are only computed when asked for."""
+        if mode == "hybrid":
+            return self._query_hybrid(q, filters, top_k, authority, with_matched)
+        mask = self.columns.mask(filters)
+        bm25 = mode == "all" and self.bm25 is not None
+        if bm25:
+            # only the candidates are scored (no pass over every row)
+            rows, sims = self._pad_rows(*self._score_bm25(q, mask, top_k, authority), mask, top_k)
+        else:
+            rows = np.arange(len(self.ids)) if mask is None else np.flatnonzero(mask)
+            sims = self._score(self.vects[mode].transform([q]), rows, mode) if len(rows) else np.zeros(0)
+        if not len(rows): return [], rows
+        matched = None
+        if with_matched:
+            matched = rows[sims > 0]
+            if bm25:
+                # pruned lists leave some matching base rows unscored: take the match set from the postings
+                base = self.bm25.matches(self._bm25_terms(q))
+                base = base if mask is None else base[mask[base]]
+                matched = np.union1d(base, matched)
+        out, exact = self._rank(q, rows, mask, sims, top_k, mode, authority, "BM25 match" if bm25 else "TF-IDF match")
+        if with_matched and exact:
+            matched = np.union1d(matched, exact)
+        return out, matched
+
+    def _query_hybrid(self, q: str, filters: Optional[Dict], top_k: int, authority: float, with_matched: bool):
+        """Reciprocal rank fusion of the lexical ("all") and dense rankings, retrieved concurrently."""
+        dense = _dense_pool.submit(self.dense.search, q, RRF_DEPTH, self.columns.mask(filters))
+        lexical, matched = self._query(q, filters, RRF_DEPTH, "all", authority, with_matched)
+        rows, _ = dense.result()
+        fused: Dict[str, float] = {}
+        why: Dict[str, str] = {}
+        for rank, (cid, score, w) in enumerate(h for h in lexical if h[1] > 0):
+            fused[cid], why[cid] = 1.0 / (RRF_K + rank + 1), w
+        for rank, r in enumerate(rows.tolist()):
+            cid = self.ids[r]
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (RRF_K + rank + 1)
+            if cid not in why:
+                why[cid] = "Dense match"
+            elif why[cid].endswith(" match") and why[cid] != "Exact citation match":
+                # "TF-IDF match" / "BM25 match" -> "TF-IDF + dense match" / "BM25 + dense match"
+                why[cid] = why[cid][:-len(" match")] + " + dense match"
+        # an exact citation hit stays on top, as in the lexical ranking
+        order = sorted(fused, key=lambda cid: (why[cid] != "Exact citation match", -fused[cid], cid))[:top_k]
+        if with_matched and len(rows):
+            matched = np.union1d(matched, rows)
+        return [(cid, fused[cid], why[cid]) for cid in order], matched
+
+    def _rank(self, q: str, rows: np.ndarray, mask: Optional[np.ndarray], sims: np.ndarray, top_k: int,
+              mode: str, authority: float, label: str):
+        """Authority blend, exact-citation boost and top-k selection over scored rows -> (hits, exact rows)."""
+        if authority and self.graph is not None:
+            # boost matching cases by how authoritative they are in the citation graph
+            auth = np.zeros(len(rows))
+            known = rows < self.graph.rows
+            auth[known] = self.graph.authority[rows[known]]
+            sims *= 1 + authority * auth
+
+        # exact citation boost (rows is sorted, so searchsorted maps row -> position)
+        exact = self._exact_citation_hits(q) if mode in ("all", "citation") else []
+        exact = [i for i in exact if mask is None or mask[i]]
+        missing = np.setdiff1d(np.asarray(exact, dtype=np.int64), rows)
+        if len(missing):   # candidate-only (BM25) rows need not hold them
+            at = np.searchsorted(rows, missing)
+            rows, sims = np.insert(rows, at, missing), np.insert(sims, at, 0.0)
+        pos = np.searchsorted(rows, exact)
+        sims[pos] = np.maximum(sims[pos], max(1.5, float(sims.max(initial=0.0)) + 0.5))
+
+        k = min(top_k, len(rows))
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.lexsort((rows[top], -sims[top]))]
+        exact_set = set(exact)
+        out = []
+        for p in top:
+            i = int(rows[p])
+            why = "Exact citation match" if i in exact_set else (label if sims[p] > 0 else "match")
+            out.append((self.ids[i], float(sims[p]), why))
+        return out, exact
+
+    def query_batch(self, queries: List[Dict], top_k: int = 25) -> List[List[Tuple[str, float, str]]]:
+        """
+        Many queries ({"q", "mode", "filters"}) at once. Queries sharing a mode and
+        filters are scored together with one sparse matrix-matrix product (in
+        blocks bounded by BATCH_BLOCK_BYTES); results also fill the query cache.
+        """
+        results: List[Optional[list]] = [None] * len(queries)
+        groups: Dict[tuple, List[int]] = {}
+        for j, item in enumerate(queries):
+            mode = self._mode(item.get("mode") or "all")
+            filters = item.get("filters") or {}
+            hit = query_cache.get(_cache_key(item["q"], mode, top_k, AUTHORITY_WEIGHT, filters), self.generation)
+            if hit is not None:
+                results[j] = list(hit)
+                continue
+            groups.setdefault((mode, tuple(sorted((k, v) for k, v in filters.items() if v))), []).append(j)
+        for (mode, _), members in groups.items():
+            filters = queries[members[0]].get("filters") or {}
+            if (mode == "all" and self.bm25 is not None) or mode == "hybrid":
+                for j in members:   # pruned BM25 and the fused ranking are one query at a time
+                    results[j] = self.query(queries[j]["q"], filters, top_k, mode)
+                continue
+            mask = self.columns.mask(filters)
+            rows = np.arange(len(self.ids)) if mask is None else np.flatnonzero(mask)
+            block = max(1, BATCH_BLOCK_BYTES // max(1, 8 * len(rows)))
+            for lo in range(0, len(members), block):
+                part = members[lo:lo + block]
+                qs = [queries[j]["q"] for j in part]
+                sims = self._score(self.vects[mode].transform(qs), rows, mode).reshape(len(rows), len(part))
+                for c, j in enumerate(part):
+                    out, _ = self._rank(qs[c], rows, mask, sims[:, c].copy(), top_k, mode, AUTHORITY_WEIGHT, "TF-IDF match") \
+                        if len(rows) else ([], [])
+                    query_cache.put(_cache_key(qs[c], mode, top_k, AUTHORITY_WEIGHT, filters), self.generation, tuple(out))
+                    results[j] = out
+        return results
 
 # Singleton
 _index: Optional[CaseIndex] = None
+# First use happens on the request threadpool: only one thread may open (or spawn) the index.
+_index_lock = threading.Lock()
+# Serialises background compaction, full rebuilds and reloads of the singleton.
+_merge_lock = threading.Lock()
+# Every worker checks this often whether another process rebuilt or appended to the
+# snapshot (two stat calls) and, if so, reopens it in the background (0 = never).
+RELOAD_SECONDS = float(os.getenv("CASE_INDEX_RELOAD_SECONDS", "5"))
+_reload_at = 0.0
+# Seconds a swapped-out index stays open for requests still running on it.
+RETIRE_AFTER = float(os.getenv("CASE_INDEX_RETIRE_SECONDS", "60"))
+rebuild_status: Dict[str, object] = {"running": False, "generation": None, "finished": None, "error": None}
+
+# Cursor pagination: every page slices the same PAGE_DEPTH-deep ranking. The cursor
+# carries the normalised query, mode, filters and next offset (no server-side state),
+# so any worker can serve the next page; re-running the query hits the query cache.
+PAGE_DEPTH = int(os.getenv("CASE_SEARCH_PAGE_DEPTH", "500"))
+
+def _encode_cursor(q: str, mode: str, filters: Dict, offset: int) -> str:
+    raw = json.dumps([q, mode, filters, offset], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _decode_cursor(cursor: str):
+    # a cursor comes back from the client: validate it as strictly as the request body
+    try:
+        q, mode, filters, offset = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(q, str) and mode in get_args(SearchMode) and isinstance(filters, dict) \
+                and type(offset) is int and offset >= 0:
+            filters = {k: v for k, v in SearchFilters(**filters).model_dump().items() if v}
+            return q, mode, filters, offset
+    except (ValueError, TypeError):   # includes pydantic's ValidationError
+        pass
+    raise KeyError(cursor)
+
+def search_page(idx, q: str, filters: Optional[Dict], mode: str, page_size: int, cursor: Optional[str] = None):
+    """
+    (hits, next_cursor, query) for one page; the query is the (normalised) one the hits
+    belong to, which for a cursor is the cursor's, not the request's. Raises KeyError
+    for a malformed cursor.
+    """
+    if cursor:
+        q, mode, filters, offset = _decode_cursor(cursor)
+    else:
+        q, filters, offset = _norm_query(q), {k: v for k, v in (filters or {}).items() if v}, 0
+    hits = idx.query(q, filters, top_k=PAGE_DEPTH, mode=mode)
+    nxt = offset + page_size
+    return hits[offset:nxt], (_encode_cursor(q, mode, filters, nxt) if nxt < len(hits) else None), q
+
+def _open_index():
+    """The serving index as configured: shard processes, or the snapshot-backed CaseIndex."""
+    from utils.shards import SHARDS, SHARD_DIR, ShardedCaseIndex
+    if SHARDS > 0:
+        # scatter-gather over shard processes (see scripts/build_case_shards.py)
+        return ShardedCaseIndex(SHARD_DIR, SHARDS).start()
+    idx = CaseIndex(DATA_DIR / "cases.sample.jsonl", SNAPSHOT_DIR)
+    idx.load()
+    return idx
 
 def get_index() -> CaseIndex:
     global _index
-    if _index is None:
-        p = Path(__file__).parent.parent / "data" / "cases.sample.jsonl"
-        _index = CaseIndex(p); _index.load()
-    return _index
+    idx = _index
+    if idx is None:
+        with _index_lock:
+            if _index is None:
+                _index = _open_index()
+                _merge_if_due(_index)
+            idx = _index
+    if RELOAD_SECONDS > 0 and time.monotonic() >= _reload_at:
+        _reload_if_stale(idx)
+    return idx
+
+def _reload_if_stale(idx):
+    global _reload_at
+    _reload_at = time.monotonic() + RELOAD_SECONDS
+    if not idx.stale() or not _merge_lock.acquire(blocking=False):
+        return
+
+    def run():
+        fresh = None
+        try:
+            fresh = _open_index()
+            fresh.validate()
+            if _swap_index(fresh, expected=idx):
+                logger.info("Reloaded the case index from a newer snapshot (generation %d)", fresh.generation)
+            else:
+                fresh.close()
+                fresh = None
+        except Exception:
+            fresh = None
+            logger.exception("Reloading the case index failed; still serving the previous one")
+        finally:
+            _merge_lock.release()
+        if fresh is not None:
+            _merge_if_due(fresh)   # e.g. ingestion pushed the deltas past the threshold
+
+    threading.Thread(target=run, name="case-index-reload", daemon=True).start()
+
+def _swap_index(fresh, expected=None) -> bool:
+    """Point the singleton at `fresh` (only if it is still `expected`, when given) and retire the old one."""
+    global _index
+    old = _index
+    if expected is not None and old is not expected:
+        return False
+    _index = fresh   # a single reference assignment: readers see the old index or the new one
+    if old is not None and old is not fresh:
+        t = threading.Timer(RETIRE_AFTER, old.close)
+        t.daemon = True
+        t.start()
+    return True
+
+def _build_index():
+    from utils.shards import SHARDS, SHARD_DIR, ShardedCaseIndex
+    if SHARDS > 0:
+        # shard directories are rebuilt offline (scripts/build_case_shards.py); restart the workers on them
+        fresh = ShardedCaseIndex(SHARD_DIR, SHARDS).start()
+        try:
+            fresh.validate()
+        except Exception:
+            fresh.close()
+            raise
+        return fresh
+    fresh = CaseIndex(DATA_DIR / "cases.sample.jsonl", SNAPSHOT_DIR)
+    fresh.fit()
+    if SIMILAR_TOP_N > 0:
+        fresh.build_similar()
+    fresh.validate()     # never replace a good snapshot with a broken one
+    fresh.save(SNAPSHOT_DIR)
+    fresh = CaseIndex(DATA_DIR / "cases.sample.jsonl", SNAPSHOT_DIR)
+    fresh.load()         # serve from the mmapped snapshot, plus anything appended meanwhile
+    fresh.validate()
+    return fresh
+
+def rebuild_in_background() -> Optional[threading.Thread]:
+    """
+    Rebuild the case index from source on a daemon thread, validate it and swap
+    it in. Requests already holding the old index finish on it. Returns None if
+    a rebuild or merge is already running.
+    """
+    if not _merge_lock.acquire(blocking=False):
+        return None
+    rebuild_status.update(running=True, error=None)
+
+    def run():
+        try:
+            fresh = _build_index()
+            _swap_index(fresh)
+            rebuild_status.update(generation=fresh.generation)
+            logger.info("Case index rebuilt and swapped in (generation %d)", fresh.generation)
+        except Exception as e:
+            rebuild_status.update(error=f"{type(e).__name__}: {e}")
+            logger.exception("Case index rebuild failed; still serving the previous index")
+        finally:
+            rebuild_status.update(running=False, finished=datetime.now().isoformat(timespec="seconds"))
+            _merge_lock.release()
+
+    t = threading.Thread(target=run, name="case-index-rebuild", daemon=True)
+    t.start()
+    return t
+
+@contextmanager
+def _merge_claim(d: Optional[Path]):
+    """Non-blocking cross-process lock: yields False while another process compacts snapshot d."""
+    if fcntl is None or not d:
+        yield True
+        return
+    with open(d.with_name(d.name + ".merge.lock"), "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _merge_if_due(idx):
+    if isinstance(idx, CaseIndex) and idx.delta_rows >= MERGE_THRESHOLD:
+        merge_in_background(idx)
+
+def merge_in_background(idx: Optional[CaseIndex] = None) -> Optional[threading.Thread]:
+    """
+    Compact delta segments on a daemon thread and swap the singleton when done. Only one
+    worker per snapshot compacts; the others pick the new snapshot up on their next reload.
+    """
+    idx = idx or get_index()
+    if not isinstance(idx, CaseIndex) or not idx.deltas or not _merge_lock.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            with _merge_claim(Path(idx.snapshot_dir) if idx.snapshot_dir else None) as ours:
+                # stale: another worker has compacted (or appended) since we opened it
+                if not ours or idx.stale():
+                    return
+                fresh = idx.compact()
+                if _swap_index(fresh, expected=idx):
+                    logger.info("Compacted %d delta rows into a new base (generation %d)", idx.delta_rows, fresh.generation)
+                else:
+                    fresh.close()
+        except Exception:
+            logger.exception("Background case index merge failed")
+        finally:
+            _merge_lock.release()
+
+    t = threading.Thread(target=run, name="case-index-merge", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,297 @@
+# utils/shards.py
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import heapq
+import logging
+import multiprocessing as mp
+import os
+import threading
+import zlib
+
+from utils.case_store import _Ids, stub_prefix
+from utils.citations import CitationGraph
+from utils.similar import NeighbourTable
+from utils.typeahead import SUGGEST_LIMIT
+from utils.search import CaseIndex, DATA_DIR, AUTHORITY_WEIGHT, query_cache, _cache_key, _norm_query, _generations, _snapshot_stamp
+
+logger = logging.getLogger(__name__)
+
+# Number of shard processes serving /cases/search (0 = single in-process index).
+SHARDS = int(os.getenv("CASE_INDEX_SHARDS", "0"))
+SHARD_DIR = Path(os.getenv("CASE_SHARD_DIR", str(DATA_DIR / "case_shards")))
+# stubs of recent hits, so building a result page needs no extra round trip
+STUB_CACHE = 10_000
+
+
+def shard_of(cid: str, n: int) -> int:
+    """Stable shard assignment of a case id, so single-case lookups go to one shard."""
+    return zlib.crc32(cid.encode("utf-8")) % n
+
+
+def _search(idx: CaseIndex, *args, **kw):
+    return [(cid, score, why, idx.stub(cid)) for cid, score, why in idx.query(*args, **kw)]
+
+
+def _search_faceted(idx: CaseIndex, *args, **kw):
+    hits, facets = idx.query_faceted(*args, **kw)
+    return [(cid, score, why, idx.stub(cid)) for cid, score, why in hits], facets
+
+
+def _search_batch(idx: CaseIndex, *args, **kw):
+    return [[(cid, score, why, idx.stub(cid)) for cid, score, why in hits] for hits in idx.query_batch(*args, **kw)]
+
+
+_CALLS = {
+    "search": _search,
+    "search_batch": _search_batch,
+    "search_faceted": _search_faceted,
+    "get_case": CaseIndex.get_case,
+    "get_cases": CaseIndex.get_cases,
+    "stub": CaseIndex.stub,
+    "stubs": lambda idx, cids: [idx.stub(cid) for cid in cids],
+    "similar_cases": CaseIndex.similar_cases,
+    "citation_links": CaseIndex.citation_links,
+    "snippets_for": CaseIndex.snippets_for,
+    "suggest": CaseIndex.suggest,
+}
+
+
+def _serve(conn, jsonl: str, snapshot_dir: str):
+    """Shard worker: load one shard and answer calls until told to stop."""
+    idx = CaseIndex(Path(jsonl), Path(snapshot_dir))
+    idx.load()
+    conn.send(len(idx.ids))
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        name, args, kw = msg
+        try:
+            conn.send((True, _CALLS[name](idx, *args, **kw)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    idx.store.close()
+
+
+class _Shard:
+    def __init__(self, n: int, root: Path, ctx):
+        self.n = n
+        self.conn, child = ctx.Pipe()
+        d = root / f"shard-{n}"
+        self.proc = ctx.Process(target=_serve, args=(child, str(d / "cases.jsonl"), str(d / "index")),
+                                name=f"case-shard-{n}", daemon=True)
+        self.lock = threading.Lock()   # one request in flight per shard pipe
+        self.rows = 0
+
+    def call(self, name: str, *args, **kw):
+        with self.lock:
+            self.conn.send((name, args, kw))
+            ok, res = self.conn.recv()
+        if not ok:
+            raise RuntimeError(f"case shard {self.n}: {res}")
+        return res
+
+
+class ShardedCaseIndex:
+    """
+    The corpus partitioned over N worker processes, each holding one shard's
+    matrices, metadata and case store. Queries are scattered to every shard in
+    parallel and the per-shard top-k lists are merged with a heap; single-case
+    lookups go straight to the owning shard (see shard_of). Similar cases and
+    citation links cross shards, so they come from whole-corpus tables under
+    root/shared (see CaseIndex.save_shared), opened here by the parent.
+    """
+
+    def __init__(self, root: Path, n: int):
+        self.root = Path(root)
+        self.n = n
+        self.generation = next(_generations)
+        self._shards: List[_Shard] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._stubs: Dict[str, Dict] = {}
+        self._stub_json: Dict[str, bytes] = {}
+        self.snapshot_stamp = None
+        self.ids: Optional[_Ids] = None
+        self.similar: Optional[NeighbourTable] = None
+        self.graph: Optional[CitationGraph] = None
+
+    def _dirs(self) -> List[Path]:
+        return [self.root / f"shard-{i}" / "index" for i in range(self.n)]
+
+    def stale(self) -> bool:
+        """True once any shard's snapshot on disk differs from the one its worker opened."""
+        return self.snapshot_stamp is not None and [_snapshot_stamp(d) for d in self._dirs()] != self.snapshot_stamp
+
+    def start(self):
+        # spawn: never fork a process that already runs server threads
+        ctx = mp.get_context("spawn")
+        # taken before the workers open their snapshots: a change after this point means a reload
+        self.snapshot_stamp = [_snapshot_stamp(d) for d in self._dirs()]
+        shared = self.root / "shared"
+        if (shared / "id_hashes.npy").exists():
+            self.ids = _Ids.open(shared)
+            self.similar = NeighbourTable.open(shared / "similar") if (shared / "similar" / "indptr.npy").exists() else None
+            self.graph = CitationGraph.open(shared / "graph") if (shared / "graph" / "indptr.npy").exists() else None
+        self._shards = [_Shard(i, self.root, ctx) for i in range(self.n)]
+        for s in self._shards:
+            s.proc.start()
+        for s in self._shards:
+            s.rows = s.conn.recv()
+        self._pool = ThreadPoolExecutor(max_workers=self.n, thread_name_prefix="case-shard")
+        logger.info("Started %d case shards (%d cases)", self.n, len(self))
+        return self
+
+    def close(self):
+        for s in self._shards:
+            try:
+                s.conn.send(None)
+            except Exception:
+                pass
+        for s in self._shards:
+            s.proc.join(timeout=5)
+        if self._pool:
+            self._pool.shutdown(wait=False)
+
+    def __len__(self):
+        return sum(s.rows for s in self._shards)
+
+    def validate(self):
+        """Raise unless the shards came up with cases and all answer a probe query."""
+        if not len(self):
+            raise ValueError("case shards are empty")
+        self._scatter("search", "validate", None, 1, "all", 0.0)
+
+    def _owner(self, cid: str) -> _Shard:
+        return self._shards[shard_of(cid, self.n)]
+
+    def query(self, q: str, filters: Optional[Dict] = None, top_k: int = 25, mode: str = "all",
+              authority: Optional[float] = None) -> List[Tuple[str, float, str]]:
+        authority = AUTHORITY_WEIGHT if authority is None else authority
+        key = _cache_key(q, mode, top_k, authority, filters)
+        hit = query_cache.get(key, self.generation)
+        if hit is not None:
+            return list(hit)
+        results = self._scatter("search", q, filters, top_k, mode, authority)
+        out = self._merge(results, top_k)
+        query_cache.put(key, self.generation, tuple(out))
+        return out
+
+    def query_faceted(self, q: str, filters: Optional[Dict] = None, top_k: int = 25, mode: str = "all",
+                      authority: Optional[float] = None):
+        authority = AUTHORITY_WEIGHT if authority is None else authority
+        key = _cache_key(q, mode, top_k, authority, filters) + ("facets",)
+        hit = query_cache.get(key, self.generation)
+        if hit is not None:
+            return list(hit[0]), hit[1]
+        results = self._scatter("search_faceted", q, filters, top_k, mode, authority)
+        out = self._merge([hits for hits, _ in results], top_k)
+        # shards hold disjoint rows, so facet counts simply add up
+        facets: Dict[str, Dict[str, int]] = {}
+        for _, part in results:
+            for name, counts in part.items():
+                dest = facets.setdefault(name, {})
+                for value, c in counts.items():
+                    dest[value] = dest.get(value, 0) + c
+        facets = {name: dict(sorted(counts.items(), key=(lambda kv: kv[0]) if name == "year" else (lambda kv: -kv[1])))
+                  for name, counts in facets.items()}
+        query_cache.put(key, self.generation, (tuple(out), facets))
+        return out, facets
+
+    def query_batch(self, queries: List[Dict], top_k: int = 25) -> List[List[Tuple[str, float, str]]]:
+        results = self._scatter("search_batch", queries, top_k)
+        return [self._merge([part[j] for part in results], top_k) for j in range(len(queries))]
+
+    def _scatter(self, name: str, *args) -> list:
+        futures = [self._pool.submit(s.call, name, *args) for s in self._shards]
+        return [f.result() for f in futures]
+
+    def _merge(self, results: list, top_k: int) -> List[Tuple[str, float, str]]:
+        merged = heapq.nsmallest(top_k, (h for hits in results for h in hits), key=lambda h: (-h[1], h[0]))
+        if len(self._stubs) > STUB_CACHE:
+            self._stubs.clear()
+            self._stub_json.clear()
+        self._stubs.update((cid, stub) for cid, _, _, stub in merged)
+        return [(cid, score, why) for cid, score, why, _ in merged]
+
+    def stub(self, cid: str) -> Optional[Dict]:
+        stub = self._stubs.get(cid)
+        return stub if stub is not None else self._owner(cid).call("stub", cid)
+
+    def stub_json(self, cid: str) -> Optional[bytes]:
+        b = self._stub_json.get(cid)
+        if b is None:
+            stub = self.stub(cid)
+            if stub is None:
+                return None
+            b = self._stub_json[cid] = stub_prefix(stub)
+        return b
+
+    def suggest(self, q: str, limit: int = SUGGEST_LIMIT) -> List[Dict]:
+        # a party name can occur on several shards: add up its weight
+        merged: Dict[Tuple[str, str], Dict] = {}
+        for part in self._scatter("suggest", q, limit):
+            for s in part:
+                key = (s["kind"], s["text"].lower())
+                if key in merged:
+                    merged[key]["score"] += s["score"]
+                else:
+                    merged[key] = dict(s)
+        return sorted(merged.values(), key=lambda s: (-s["score"], s["text"].lower()))[:limit]
+
+    def snippets_for(self, q: str, cids: List[str]) -> Dict[str, List[str]]:
+        key = ("snippets", _norm_query(q), tuple(cids))
+        hit = query_cache.get(key, self.generation)
+        if hit is not None:
+            return dict(hit)
+        by_shard: Dict[int, List[str]] = {}
+        for cid in cids:
+            by_shard.setdefault(shard_of(cid, self.n), []).append(cid)
+        futures = [self._pool.submit(self._shards[n].call, "snippets_for", q, part) for n, part in by_shard.items()]
+        out: Dict[str, List[str]] = {}
+        for f in futures:
+            out.update(f.result())
+        query_cache.put(key, self.generation, out)
+        return dict(out)
+
+    def get_case(self, cid: str) -> Optional[Dict]:
+        return self._owner(cid).call("get_case", cid)
+
+    def get_cases(self, cids: List[str]) -> List[Optional[Dict]]:
+        by_shard: Dict[int, List[int]] = {}
+        for i, cid in enumerate(cids):
+            by_shard.setdefault(shard_of(cid, self.n), []).append(i)
+        futures = {n: self._pool.submit(self._shards[n].call, "get_cases", [cids[i] for i in pos])
+                   for n, pos in by_shard.items()}
+        out: List[Optional[Dict]] = [None] * len(cids)
+        for n, pos in by_shard.items():
+            for i, c in zip(pos, futures[n].result()):
+                out[i] = c
+        return out
+
+    def _stubs_for(self, cids: List[str]) -> List[Optional[Dict]]:
+        """Stubs of cases spread over the shards: cached ones, then one call per owning shard."""
+        missing: Dict[int, List[str]] = {}
+        for cid in cids:
+            if cid not in self._stubs:
+                missing.setdefault(shard_of(cid, self.n), []).append(cid)
+        futures = {n: self._pool.submit(self._shards[n].call, "stubs", part) for n, part in missing.items()}
+        found = {cid: stub for n, part in missing.items() for cid, stub in zip(part, futures[n].result())}
+        return [self._stubs[cid] if cid in self._stubs else found[cid] for cid in cids]
+
+    def similar_cases(self, cid: str):
+        row = self.ids.get(cid) if self.ids is not None else None
+        if row is None or self.similar is None:
+            return self._owner(cid).call("similar_cases", cid)
+        rows, scores = self.similar.neighbours(row)
+        stubs = self._stubs_for([self.ids[r] for r in rows.tolist()])
+        return [(stub, float(s)) for stub, s in zip(stubs, scores.tolist()) if stub is not None]
+
+    def citation_links(self, cid: str):
+        row = self.ids.get(cid) if self.ids is not None else None
+        if row is None or self.graph is None:
+            return self._owner(cid).call("citation_links", cid)
+        cites, cited_by = self.graph.neighbours(row)
+        stubs = self._stubs_for([self.ids[r] for r in cites.tolist() + cited_by.tolist()])
+        return {"cites": [s for s in stubs[:len(cites)] if s is not None],
+                "citedBy": [s for s in stubs[len(cites):] if s is not None]}
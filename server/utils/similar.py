@@ -0,0 +1,78 @@
+# utils/similar.py
+from pathlib import Path
+from typing import Tuple
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+# neighbours kept per case and the memory budget for one block of the similarity product
+SIMILAR_TOP_N = int(os.getenv("CASE_SIMILAR_TOP_N", "10"))
+BLOCK_BYTES = int(os.getenv("CASE_SIMILAR_BLOCK_MB", "256")) << 20
+
+
+def nearest_neighbours(mat: sparse.csr_matrix, top_n: int = SIMILAR_TOP_N,
+                       block_bytes: int = BLOCK_BYTES) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Top-n cosine neighbours of every row of an L2-normalised CSR matrix, as a
+    CSR (indptr, indices, scores) table. Rows are processed in blocks whose
+    similarity product fits in `block_bytes`, so memory stays bounded.
+    """
+    n = mat.shape[0]
+    mat = mat.tocsr()
+    mt = mat.T.tocsc()
+    # worst case a block row is dense: 12 bytes (float64 + int32) per column
+    block = max(1, min(n, block_bytes // max(1, 12 * n)))
+    counts = np.zeros(n, dtype=np.int64)
+    indices, scores = [], []
+    for lo in range(0, n, block):
+        hi = min(n, lo + block)
+        sims = (mat[lo:hi] @ mt).tocsr()
+        sims.setdiag(0, k=lo)     # a case is not its own neighbour
+        sims.eliminate_zeros()
+        for r in range(hi - lo):
+            a, b = sims.indptr[r], sims.indptr[r + 1]
+            cols, vals = sims.indices[a:b], sims.data[a:b]
+            if len(vals) > top_n:
+                keep = np.argpartition(-vals, top_n - 1)[:top_n]
+                cols, vals = cols[keep], vals[keep]
+            order = np.lexsort((cols, -vals))
+            indices.append(cols[order].astype(np.int32)); scores.append(vals[order].astype(np.float32))
+            counts[lo + r] = len(order)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    cat = lambda parts, dt: np.concatenate(parts).astype(dt) if parts else np.zeros(0, dtype=dt)
+    return indptr, cat(indices, np.int32), cat(scores, np.float32)
+
+
+class NeighbourTable:
+    """Precomputed similar-cases graph; neighbours(row) is two array slices."""
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, scores: np.ndarray):
+        self.indptr, self.indices, self.scores = indptr, indices, scores
+
+    @property
+    def rows(self) -> int:
+        return len(self.indptr) - 1
+
+    @classmethod
+    def build(cls, mat: sparse.csr_matrix, top_n: int = SIMILAR_TOP_N) -> "NeighbourTable":
+        return cls(*nearest_neighbours(mat, top_n))
+
+    def neighbours(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        if row >= self.rows:
+            return self.indices[:0], self.scores[:0]   # ingested after the table was built
+        a, b = self.indptr[row], self.indptr[row + 1]
+        return self.indices[a:b], self.scores[a:b]
+
+    def save(self, d: Path, ids):
+        d.mkdir(parents=True, exist_ok=True)
+        np.save(d / "indptr.npy", self.indptr)
+        np.save(d / "indices.npy", self.indices)
+        np.save(d / "scores.npy", self.scores)
+        (d / "ids.json").write_text(json.dumps(list(ids)), encoding="utf-8")
+
+    @classmethod
+    def open(cls, d: Path):
+        return cls(*(np.load(d / f"{n}.npy", mmap_mode="r") for n in ("indptr", "indices", "scores")))
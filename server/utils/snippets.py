@@ -0,0 +1,139 @@
+# utils/snippets.py
+from html import escape
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import json
+import os
+import re
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+# target passage length (chars) and passages returned per hit
+PASSAGE_CHARS = int(os.getenv("CASE_PASSAGE_CHARS", "320"))
+SNIPPETS_PER_HIT = int(os.getenv("CASE_SNIPPETS", "2"))
+BUILD_CHUNK = 2_000
+
+# sentence ends (";" and ":" too: judgments run long enumerations) and paragraph breaks
+_BREAK_RX = re.compile(r"(?<=[.?!;:])\s+|\n\s*\n")
+
+
+def passage_spans(text: str, size: int = PASSAGE_CHARS) -> List[Tuple[int, int]]:
+    """Split text into (start, end) char spans of roughly `size`, cut at sentence breaks where possible."""
+    spans: List[Tuple[int, int]] = []
+    start = last = 0
+    for cut in [m.end() for m in _BREAK_RX.finditer(text)] + [len(text)]:
+        if cut - start > size and last > start:
+            spans.append((start, last)); start = last
+        while cut - start > 2 * size:   # a long stretch without a sentence break
+            end = text.rfind(" ", start + 1, start + size)
+            end = end if end > start else start + size
+            spans.append((start, end)); start = end
+        last = cut
+    if last > start and text[start:last].strip():
+        spans.append((start, last))
+    return spans
+
+
+def query_words(analyzer, q: str) -> List[str]:
+    """Unigrams of q as the index tokenises them."""
+    return sorted({w for w in analyzer(q) if " " not in w})
+
+
+def word_pattern(words: Sequence[str]) -> Optional["re.Pattern"]:
+    words = [w for w in words if len(w) > 2 or w.isdigit()]
+    if not words:
+        return None
+    return re.compile(r"(?<!\w)(" + "|".join(map(re.escape, sorted(words, key=len, reverse=True))) + r")(?!\w)", re.I)
+
+
+def highlight(text: str, spans: Iterable[Tuple[int, int]], rx: Optional["re.Pattern"]) -> List[str]:
+    """HTML-escaped passages with query words wrapped in <mark>."""
+    out = []
+    for a, b in spans:
+        parts = (rx.split if rx is not None else lambda s: [s])(" ".join(text[a:b].split()))
+        # split() with a capture group alternates plain text and matched words
+        out.append("".join(f"<mark>{escape(p)}</mark>" if i % 2 else escape(p) for i, p in enumerate(parts)))
+    return out
+
+
+def best_spans(text: str, rx: Optional["re.Pattern"], n: int = SNIPPETS_PER_HIT) -> List[Tuple[int, int]]:
+    """Slow path for cases without a passage table: scan every passage of the text."""
+    if rx is None:
+        return []
+    spans = passage_spans(text)
+    scores = [len({m.group(0).lower() for m in rx.finditer(text, a, b)}) for a, b in spans]
+    order = sorted((i for i, s in enumerate(scores) if s), key=lambda i: (-scores[i], i))[:n]
+    return [spans[i] for i in sorted(order)]
+
+
+class PassageTable:
+    """
+    Sentence-aligned passages of every case's judgment text: char offsets plus
+    the unigram terms present in each passage. Picking the best passages for a
+    query reads only this table; the text itself is sliced for the winners only.
+    """
+
+    def __init__(self, case_ptr: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 term_ptr: np.ndarray, terms: np.ndarray):
+        self.case_ptr, self.starts, self.ends = case_ptr, starts, ends   # case row -> passages
+        self.term_ptr, self.terms = term_ptr, terms                      # passage -> term ids
+
+    @property
+    def rows(self) -> int:
+        return len(self.case_ptr) - 1
+
+    @classmethod
+    def build(cls, texts: Iterable[str], vocabulary: Dict[str, int], size: int = PASSAGE_CHARS) -> "PassageTable":
+        # binary unigram presence over the "all" vocabulary (same lowercasing / token pattern)
+        counter = CountVectorizer(vocabulary=vocabulary, binary=True)
+        case_ptr, starts, ends, term_ptr, terms = [0], [], [], [np.zeros(1, np.int64)], []
+        n_terms = 0
+        batch: List[str] = []
+
+        def flush():
+            nonlocal n_terms
+            if not batch: return
+            m = counter.transform(batch).tocsr()
+            m.sort_indices()
+            term_ptr.append(m.indptr[1:].astype(np.int64) + n_terms)
+            terms.append(m.indices.astype(np.int32))
+            n_terms += m.nnz
+            batch.clear()
+
+        for text in texts:
+            text = text or ""
+            spans = passage_spans(text, size)
+            case_ptr.append(case_ptr[-1] + len(spans))
+            for a, b in spans:
+                starts.append(a); ends.append(b)
+                batch.append(text[a:b])
+            if len(batch) >= BUILD_CHUNK: flush()
+        flush()
+        return cls(np.asarray(case_ptr, np.int64), np.asarray(starts, np.int32), np.asarray(ends, np.int32),
+                   np.concatenate(term_ptr), np.concatenate(terms) if terms else np.zeros(0, np.int32))
+
+    def best(self, row: int, terms: np.ndarray, weights: np.ndarray, n: int = SNIPPETS_PER_HIT) -> List[Tuple[int, int]]:
+        """Up to n (start, end) spans of the row's passages with the most query-term weight, in text order."""
+        if not len(terms) or row >= self.rows:
+            return []
+        p0, p1 = int(self.case_ptr[row]), int(self.case_ptr[row + 1])
+        a, b = int(self.term_ptr[p0]), int(self.term_ptr[p1])
+        ids = self.terms[a:b]
+        pos = np.searchsorted(terms, ids).clip(max=len(terms) - 1)
+        w = np.where(terms[pos] == ids, weights[pos], 0.0)
+        cum = np.concatenate([[0.0], np.cumsum(w)])
+        ptr = self.term_ptr[p0:p1 + 1] - a
+        scores = cum[ptr[1:]] - cum[ptr[:-1]]
+        top = [int(i) for i in np.argsort(-scores, kind="stable")[:n] if scores[i] > 0]
+        return [(int(self.starts[p0 + i]), int(self.ends[p0 + i])) for i in sorted(top)]
+
+    def save(self, d: Path):
+        d.mkdir(parents=True, exist_ok=True)
+        for name in ("case_ptr", "starts", "ends", "term_ptr", "terms"):
+            np.save(d / f"{name}.npy", getattr(self, name))
+        (d / "meta.json").write_text(json.dumps({"passage_chars": PASSAGE_CHARS}), encoding="utf-8")
+
+    @classmethod
+    def open(cls, d: Path):
+        return cls(*(np.load(d / f"{n}.npy", mmap_mode="r") for n in ("case_ptr", "starts", "ends", "term_ptr", "terms")))
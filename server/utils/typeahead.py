@@ -0,0 +1,229 @@
+# utils/typeahead.py
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import re
+import threading
+
+import numpy as np
+
+from utils.case_store import _Blobs
+
+SUGGEST_LIMIT = 8
+# prefixes this short match a large slice of the keys; their top entries are precomputed
+SHORT_PREFIX = 2
+_NORM_RX = re.compile(r"[^\w]+")
+# "A v B", "A vs. B", "A versus B"
+_PARTIES_RX = re.compile(r"\s+(?:v|vs|versus)\.?\s+", re.I)
+_SUFFIX_RX = re.compile(r"\s*&\s*(?:ors|anr)\.?$", re.I)
+
+KINDS = ("title", "party", "citation")
+# snapshot files (under tables/) of the base view
+_FILES = ("typeahead_keys", "typeahead_texts", "typeahead_kinds.npy", "typeahead_first.npy",
+          "typeahead_weights.npy", "typeahead_short.json")
+
+
+def normalize(s: str) -> str:
+    return _NORM_RX.sub(" ", (s or "").lower()).strip()
+
+
+def _entries(c: Dict) -> Iterable[Tuple[int, str]]:
+    """(kind code, display text) suggestions contributed by one case."""
+    title = (c.get("title") or "").strip()
+    if title:
+        yield 0, title
+    p = c.get("parties") or {}
+    names = [*(p.get("appellant") or []), *(p.get("respondent") or [])] or _PARTIES_RX.split(title)[:2]
+    for name in names:
+        name = _SUFFIX_RX.sub("", name or "").strip()
+        if name and name != title:
+            yield 1, name
+    for cite in [c.get("neutral_citation"), *(c.get("reporter_citations") or [])]:
+        if cite:
+            yield 2, " ".join(cite.split())
+
+
+def _strings(items: List[bytes]) -> _Blobs:
+    ptr = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(b) for b in items), dtype=np.int64, count=len(items)), out=ptr[1:])
+    return _Blobs(np.frombuffer(b"".join(items), dtype=np.uint8), ptr)
+
+
+def _weights(rows: List[List[int]], authority: Optional[np.ndarray]) -> np.ndarray:
+    """Per entry: number of rows carrying it, each counted 1 + its authority."""
+    counts = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+    flat = np.fromiter((r for rs in rows for r in rs), dtype=np.int64, count=int(counts.sum()))
+    per_row = np.ones(len(flat), dtype=np.float64)
+    if authority is not None and len(authority):
+        known = flat < len(authority)
+        per_row[known] += np.asarray(authority)[flat[known]]
+    owner = np.repeat(np.arange(len(rows)), counts)
+    return np.bincount(owner, weights=per_row, minlength=len(rows)).astype(np.float32)
+
+
+def _range(keys, prefix: bytes) -> Tuple[int, int]:
+    # keys are UTF-8 bytes, whose order is the code point order; 0xff never occurs in UTF-8
+    lo = bisect_left(keys, prefix)
+    return lo, bisect_left(keys, prefix + b"\xff", lo)
+
+
+def _top(weights: np.ndarray, lo: int, hi: int, k: int) -> np.ndarray:
+    w = weights[lo:hi]
+    part = np.argpartition(-w, k)[:k] if len(w) > k else np.arange(len(w))
+    # heaviest first; ties go to the shorter (earlier-sorting) key
+    return lo + part[np.lexsort((part, -w[part]))]
+
+
+def _base_view(entries: List[Tuple[str, int, str, int, float]]):
+    """(keys, kinds, texts, first rows, weights, short-prefix tops) over (key, kind, text, first, weight) entries."""
+    entries.sort(key=lambda e: (e[0], e[1]))
+    keys = [e[0].encode("utf-8") for e in entries]
+    weights = np.array([e[4] for e in entries], dtype=np.float32)
+    short: Dict[str, List[int]] = {}
+    for p in sorted({e[0][:n] for e in entries for n in range(1, SHORT_PREFIX + 1) if len(e[0]) >= n}):
+        short[p] = _top(weights, *_range(keys, p.encode("utf-8")), SUGGEST_LIMIT * 4).tolist()
+    return (_strings(keys), np.array([e[1] for e in entries], dtype=np.int8),
+            _strings([e[2].encode("utf-8") for e in entries]),
+            np.array([e[3] for e in entries], dtype=np.int64), weights, short)
+
+
+def _find(base, kind: int, key: bytes) -> int:
+    """Index of (kind, key) in the base view, or -1."""
+    keys, kinds = base[0], base[1]
+    i = bisect_left(keys, key)
+    while i < len(keys) and keys[i] == key:
+        if kinds[i] == kind:
+            return i
+        i += 1
+    return -1
+
+
+class Typeahead:
+    """
+    Prefix index over normalised case titles, party names and citations: a
+    sorted key array searched with bisect, plus a popularity weight per key
+    (number of cases carrying it, each counted 1 + its citation authority).
+    The base view is built once per fit and saved with the snapshot tables,
+    where later loads mmap it. Entries added on top of a base go to a small
+    sorted tail, rebuilt by add(), whose weights already include the matching
+    base entry's; suggest() only merges the two.
+    """
+
+    def __init__(self):
+        # (kind, key) -> [display text, rows, base index or -1], for entries not folded into the base
+        self._raw: Dict[Tuple[int, str], List] = {}
+        self._lock = threading.Lock()
+        self._authority: Optional[np.ndarray] = None
+        self._views = (None, None)   # (base, tail), swapped in as one tuple
+
+    def add(self, cases: Iterable[Dict], start: int):
+        """Register the suggestions of cases at rows start, start+1, ..."""
+        with self._lock:
+            base = self._views[0]
+            for row, c in enumerate(cases, start):
+                for kind, text in _entries(c):
+                    key = normalize(text)
+                    if not key: continue
+                    e = self._raw.get((kind, key))
+                    if e is None:
+                        bi = -1 if base is None else _find(base, kind, key.encode("utf-8"))
+                        self._raw[(kind, key)] = [text, [row], bi]
+                    else:
+                        e[1].append(row)
+            if base is not None:
+                self._views = (base, self._tail(base))
+
+    def set_authority(self, authority: Optional[np.ndarray]):
+        """
+        Set the per-row authority and build the base view if there is none yet. A base
+        opened from a snapshot keeps its saved weights (the graph comes from the same snapshot).
+        """
+        with self._lock:
+            self._authority = authority
+            base = self._views[0]
+            self._views = (self._fold(), None) if base is None else (base, self._tail(base))
+
+    def save(self, d: Path):
+        with self._lock:
+            if self._views[0] is None or self._raw:
+                self._views = (self._fold(), None)
+            keys, kinds, texts, first, weights, short = self._views[0]
+        d.mkdir(parents=True, exist_ok=True)
+        keys.save(d, _FILES[0])
+        texts.save(d, _FILES[1])
+        np.save(d / _FILES[2], np.asarray(kinds))
+        np.save(d / _FILES[3], np.asarray(first))
+        np.save(d / _FILES[4], np.asarray(weights))
+        (d / _FILES[5]).write_text(json.dumps(short, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def open(cls, d: Path) -> "Typeahead":
+        t = cls()
+        t._views = ((_Blobs.open(d, _FILES[0]), np.load(d / _FILES[2], mmap_mode="r"), _Blobs.open(d, _FILES[1]),
+                     np.load(d / _FILES[3], mmap_mode="r"), np.load(d / _FILES[4], mmap_mode="r"),
+                     json.loads((d / _FILES[5]).read_text(encoding="utf-8"))), None)
+        return t
+
+    def _fold(self):
+        """A new base view holding the current base plus every pending entry (caller holds the lock)."""
+        base, items = self._views[0], list(self._raw.items())
+        extra = _weights([e[1] for _, e in items], self._authority)
+        entries = []
+        if base is not None:
+            keys, kinds, texts, first, weights, _ = base
+            w = np.array(weights, dtype=np.float32)
+            for (_, e), x in zip(items, extra):
+                if e[2] >= 0: w[e[2]] += x
+            entries = [(keys[i].decode("utf-8"), int(kinds[i]), texts[i].decode("utf-8"), int(first[i]), float(w[i]))
+                       for i in range(len(w))]
+        entries += [(key, kind, e[0], e[1][0], float(x)) for ((kind, key), e), x in zip(items, extra) if e[2] < 0]
+        self._raw = {}
+        return _base_view(entries)
+
+    def _tail(self, base):
+        """(keys, kinds, texts, first rows, weights, base index) of the pending entries, weights merged with the base."""
+        items = sorted(self._raw.items(), key=lambda kv: (kv[0][1], kv[0][0]))
+        weights = _weights([e[1] for _, e in items], self._authority)
+        first = np.array([e[1][0] for _, e in items], dtype=np.int64)
+        bi = np.array([e[2] for _, e in items], dtype=np.int64)
+        texts = [e[0] for _, e in items]
+        old = np.flatnonzero(bi >= 0)
+        if len(old):
+            weights[old] += base[4][bi[old]]
+            first[old] = base[3][bi[old]]
+            for i in old.tolist():
+                texts[i] = base[2][int(bi[i])].decode("utf-8")
+        return ([k.encode("utf-8") for (_, k), _ in items], np.array([kind for (kind, _), _ in items], dtype=np.int8),
+                texts, first, weights, bi)
+
+    def suggest(self, q: str, limit: int = SUGGEST_LIMIT) -> List[Tuple[str, str, int, float]]:
+        """Up to `limit` (text, kind, first row, weight) entries whose key starts with q."""
+        prefix = normalize(q)
+        if not prefix:
+            return []
+        base, tail = self._views
+        if base is None:   # nothing has set the authority yet (CaseIndex always does on load)
+            with self._lock:
+                if self._views[0] is None:
+                    self._views = (self._fold(), None)
+            base, tail = self._views
+        p = prefix.encode("utf-8")
+        keys, kinds, texts, first, weights, short = base
+        top = short.get(prefix) if limit <= SUGGEST_LIMIT * 4 else None
+        if top is None:
+            top = _top(weights, *_range(keys, p), limit)
+        top = np.asarray(top[:limit], dtype=np.int64)
+        # tail weights only ever add to a base entry's, so the base top-`limit` holds every
+        # base-only entry of the merged top-`limit`
+        hits = []
+        if tail is not None and len(tail[0]):
+            tkeys, tkinds, ttexts, tfirst, tweights, tbase = tail
+            lo, hi = _range(tkeys, p)
+            top = top[~np.isin(top, tbase[lo:hi])]
+            hits = [(-float(tweights[i]), tkeys[i], int(tkinds[i]), ttexts[i], int(tfirst[i]))
+                    for i in _top(tweights, lo, hi, limit).tolist()]
+        hits += [(-float(weights[i]), keys[i], int(kinds[i]), texts[i].decode("utf-8"), int(first[i]))
+                 for i in top.tolist()]
+        hits.sort(key=lambda h: h[:3])
+        return [(text, KINDS[kind], row, -w) for w, _, kind, text, row in hits[:limit]]